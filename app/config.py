@@ -2,7 +2,6 @@ import os
 import hashlib
 import json
 import pickle
-import faiss
 import numpy as np
 from pathlib import Path
 from dotenv import load_dotenv
@@ -10,6 +9,9 @@ from dotenv import load_dotenv
 load_dotenv()
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 
+from app.text_store import ChunkTextStore
+from app.metadata_store import ChunkMetadataStore
+from app.document_registry import DocumentRegistry
 from mistralai.client import MistralClient
 from mistralai.models.chat_completion import ChatMessage
 
@@ -22,26 +24,122 @@ CHUNKS_FILE = DATA_DIR / "chunks.pkl"
 METADATA_FILE = DATA_DIR / "metadata.pkl"
 PROCESSED_DOCS_FILE = DATA_DIR / "processed_docs.json"
 SESSIONS_FILE = DATA_DIR / "sessions.json"
+SESSIONS_DB_FILE = DATA_DIR / "sessions.db"
+EMBEDDING_CACHE_FILE = DATA_DIR / "embedding_cache.db"
+SEGMENTS_DIR = DATA_DIR / "segments"
+MANIFEST_FILE = DATA_DIR / "manifest.json"
+REGISTRY_LOG_FILE = DATA_DIR / "registry.log"
+INDEX_SNAPSHOT_FILE = DATA_DIR / "index_snapshot.faiss"
+DEDUP_INDEX_FILE = DATA_DIR / "dedup_index.npz"
+LEXICAL_INDEX_FILE = DATA_DIR / "lexical_index.npz"
+TEXT_STORE_DIR = DATA_DIR / "texts"
+
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+SEGMENT_SMALL_ROWS = 10000
+SEGMENT_MERGE_THRESHOLD = 8
+COMPACTION_THRESHOLD = 0.2
+
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+INDEX_METRIC = "ip"
+ANN_INDEX_TYPE = "hnsw"
+ANN_MIN_VECTORS = 50000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+IVF_MIN_POINTS_PER_LIST = 39
+SNAPSHOT_REFRESH_RATIO = 0.25
 
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 128
 TOP_K = 3
 
-MAX_HISTORY_MESSAGES = 6
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+RETRIEVAL_CANDIDATES = 50
+MMR_LAMBDA = 0.7
+MMR_MAX_PER_SOURCE = 2
+FILTER_CACHE_SIZE = 64
+FILTER_MAX_SEARCH_BOOST = 16
+LEXICAL_FAST_PATH = True
+LEXICAL_FAST_PATH_MIN_TERMS = 2
+
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_MIN_PAGE_RATIO = 0.5
+
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.9
+DEDUP_SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 8
+
+EXTRACTION_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+PDF_PAGES_PER_TASK = 50
+INGEST_EXTRACTION_WINDOW = 2
+
+EMBEDDING_MODEL = "mistral-embed"
+EMBEDDING_CACHE_MAX_ENTRIES = 500000
+EMBEDDING_CONCURRENCY = 4
+EMBEDDING_MAX_BATCH_TOKENS = 12000
+EMBEDDING_MAX_BATCH_SIZE = 128
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_RETRY_BASE_DELAY = 1.0
+
+QUESTION_CACHE_MAX_ENTRIES = 1024
+QUESTION_CACHE_TTL_SECONDS = 3600
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL_SECONDS = 3600
+ANSWER_CACHE_SIMILARITY = 0.97
+
+QUERY_BATCH_MAX_ITEMS = 16
+QUERY_BATCH_MAX_WAIT_MS = 5
+
+ASK_THREAD_POOL_SIZE = 16
+LLM_MAX_CONCURRENT = 8
+LLM_MAX_QUEUE = 32
+LLM_QUEUE_TIMEOUT_SECONDS = 30
+ASK_BATCH_MAX_QUESTIONS = 5000
+ASK_BATCH_CONCURRENCY = 4
+
+HISTORY_WINDOW_TURNS = 3
+SUMMARY_BATCH_TURNS = 2
+MAX_STORED_TURNS = 20
+SUMMARY_MODEL = "mistral-small-latest"
+SUMMARY_MAX_TOKENS = 300
 SESSION_TIMEOUT_MINUTES = 30
-MAX_TOKENS_HISTORY = 8000
+MAX_TOKENS_HISTORY = 2000
+PROMPT_TOKEN_BUDGET = 8000
+MESSAGE_TOKEN_OVERHEAD = 4
 MAX_STORED_SESSIONS = 20
 
 index = None
-chunks = []
-chunk_metadata = []
-processed_docs = []
+index_version = 0
+chunks = ChunkTextStore(TEXT_STORE_DIR)
+chunk_metadata = ChunkMetadataStore()
+chunk_ids = []
+next_chunk_id = 0
+deleted_chunk_ids = set()
+processed_docs = DocumentRegistry()
+
+startup_status = {
+    "state": "starting",
+    "ready": False,
+    "error": None,
+    "load_seconds": None
+}
 
 processing_status = {
     "is_processing": False,
     "total_files": 0,
     "processed_files": 0,
-    "chunks_created": 0
+    "chunks_created": 0,
+    "chunks_embedded": 0,
+    "chunks_deduplicated": 0,
+    "embedding_throughput": 0.0
 }
 
 session_history = {}
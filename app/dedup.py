@@ -0,0 +1,169 @@
+import re
+import threading
+import zlib
+import numpy as np
+
+from app.config import (
+    DEDUP_INDEX_FILE, DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE,
+    MINHASH_PERMUTATIONS, LSH_BANDS
+)
+
+MERSENNE_PRIME = np.uint64(4294967311)
+PENDING_MERGE_SIZE = 50000
+
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, 2**32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 4294967311, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_BAND_WEIGHTS = _rng.integers(1, 2**63, size=MINHASH_PERMUTATIONS // LSH_BANDS, dtype=np.uint64)
+_BAND_SALTS = _rng.integers(1, 2**63, size=LSH_BANDS, dtype=np.uint64)
+
+def shingles(text, size=DEDUP_SHINGLE_SIZE):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+def minhash(text):
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode('utf-8')) for s in set(shingles(text))),
+        dtype=np.uint64
+    )
+    if len(hashes) == 0:
+        return None
+    values = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % MERSENNE_PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+def minhash_many(texts):
+    return [minhash(text) for text in texts]
+
+def band_keys(signature):
+    rows = signature.astype(np.uint64).reshape(LSH_BANDS, -1)
+    return (rows * _BAND_WEIGHTS[None, :]).sum(axis=1) + _BAND_SALTS
+
+def merge_lsh_keys(parts):
+    return {
+        "keys": np.concatenate([part["keys"] for part in parts]),
+        "ids": np.concatenate([part["ids"] for part in parts])
+    }
+
+def similarity(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+class DedupIndex:
+    def __init__(self, index_file=DEDUP_INDEX_FILE):
+        self.index_file = index_file
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.ids = np.zeros(0, dtype=np.int64)
+            self.pending = {}
+            self.unsaved = []
+
+    def load(self):
+        self.clear()
+        if not self.index_file.exists():
+            return False
+        with np.load(self.index_file) as data:
+            self.keys = data["keys"]
+            self.ids = data["ids"]
+        print(f"Index de déduplication chargé ({len(self.keys)} clés LSH)")
+        return True
+
+    def load_segments(self, parts):
+        self.clear()
+        if not parts:
+            return
+        merged = merge_lsh_keys(parts)
+        order = np.argsort(merged["keys"], kind='stable')
+        with self.lock:
+            self.keys = merged["keys"][order]
+            self.ids = merged["ids"][order]
+        print(f"Index de déduplication chargé depuis les segments ({len(self.keys)} clés LSH)")
+
+    def _merge_pending(self):
+        if not self.pending:
+            return
+        keys = np.fromiter(
+            (key for key, ids in self.pending.items() for _ in ids), dtype=np.uint64
+        )
+        ids = np.fromiter(
+            (chunk_id for ids in self.pending.values() for chunk_id in ids), dtype=np.int64
+        )
+        all_keys = np.concatenate([self.keys, keys])
+        all_ids = np.concatenate([self.ids, ids])
+        order = np.argsort(all_keys, kind='stable')
+        self.keys = all_keys[order]
+        self.ids = all_ids[order]
+        self.pending = {}
+
+    def candidates(self, keys):
+        found = []
+        with self.lock:
+            for key in keys:
+                key = int(key)
+                found.extend(self.pending.get(key, ()))
+                pos = np.searchsorted(self.keys, np.uint64(key))
+                while pos < len(self.keys) and self.keys[pos] == key:
+                    found.append(int(self.ids[pos]))
+                    pos += 1
+        return list(dict.fromkeys(found))
+
+    def add_many(self, chunk_ids, signatures):
+        with self.lock:
+            for chunk_id, signature in zip(chunk_ids, signatures):
+                if signature is None:
+                    continue
+                keys = band_keys(signature)
+                self.unsaved.append((int(chunk_id), keys))
+                for key in keys:
+                    self.pending.setdefault(int(key), []).append(int(chunk_id))
+            if len(self.pending) >= PENDING_MERGE_SIZE:
+                self._merge_pending()
+
+    def discard(self, dead_ids):
+        if not dead_ids:
+            return
+        with self.lock:
+            self._merge_pending()
+            keep = ~np.isin(self.ids, np.fromiter(dead_ids, dtype=np.int64, count=len(dead_ids)))
+            self.keys = self.keys[keep]
+            self.ids = self.ids[keep]
+
+    def segment_arrays(self, rewrite=False):
+        with self.lock:
+            if rewrite:
+                self._merge_pending()
+                return {"keys": self.keys, "ids": self.ids}
+            if not self.unsaved:
+                return {"keys": np.zeros(0, dtype=np.uint64), "ids": np.zeros(0, dtype=np.int64)}
+            return {
+                "keys": np.concatenate([keys for _, keys in self.unsaved]).astype(np.uint64),
+                "ids": np.repeat(
+                    np.array([chunk_id for chunk_id, _ in self.unsaved], dtype=np.int64),
+                    [len(keys) for _, keys in self.unsaved]
+                )
+            }
+
+    def mark_saved(self, last_id):
+        with self.lock:
+            self.unsaved = [entry for entry in self.unsaved if entry[0] > last_id]
+
+def find_duplicate(signature, index, batch_buckets, text_for_id, threshold=DEDUP_THRESHOLD):
+    if signature is None:
+        return None
+    keys = band_keys(signature)
+    candidates = [chunk_id for k in keys for chunk_id in batch_buckets.get(int(k), ())]
+    candidates += index.candidates(keys)
+    for chunk_id in dict.fromkeys(candidates):
+        text = text_for_id(chunk_id)
+        if text is None:
+            continue
+        other = minhash(text)
+        if other is not None and similarity(signature, other) >= threshold:
+            return chunk_id
+    return None
+
+dedup_index = DedupIndex()
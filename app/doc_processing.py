@@ -1,19 +1,34 @@
-import io
+import asyncio
+import bisect
 import json
 import pickle
 import traceback
 import numpy as np
-import faiss
-import PyPDF2
+from concurrent.futures.process import BrokenProcessPool
 
 from app.config import (
-    index, chunks, chunk_metadata, processed_docs, processing_status,
+    index, chunks, chunk_metadata, chunk_ids, deleted_chunk_ids,
+    processed_docs, processing_status,
     DATA_DIR, UPLOADS_DIR,
-    INDEX_FILE, CHUNKS_FILE, METADATA_FILE, PROCESSED_DOCS_FILE,
-    CHUNK_SIZE, CHUNK_OVERLAP, TOP_K,
-    client
+    INDEX_FILE, CHUNKS_FILE, METADATA_FILE, PROCESSED_DOCS_FILE, LEXICAL_INDEX_FILE, DEDUP_INDEX_FILE,
+    CHUNK_SIZE, CHUNK_OVERLAP, TOP_K, COMPACTION_THRESHOLD,
+    INDEX_TYPE, INDEX_METRIC, ANN_INDEX_TYPE, ANN_MIN_VECTORS,
+    HNSW_M, HNSW_EF_CONSTRUCTION, IVF_NLIST, IVF_MIN_POINTS_PER_LIST,
+    SNAPSHOT_REFRESH_RATIO,
+    EXTRACTION_WORKERS, PDF_PAGES_PER_TASK, INGEST_EXTRACTION_WINDOW, DEDUP_ENABLED
+)
+from app.utils import calculate_file_hash
+from app.embedding_engine import embedding_engine
+from app.segment_store import segment_store
+from app.metadata_store import column_rows
+from app.dedup import dedup_index, minhash_many, band_keys, find_duplicate
+from app.lexical_index import lexical_index
+from app.tokens import count_tokens
+from app.concurrency import index_lock
+from app.extraction import (
+    get_extraction_pool, new_extraction_pool, shutdown_extraction_pool, count_pdf_pages, extract_pdf_chunks, extract_text_chunks,
+    merge_extracted
 )
-from app.utils import calculate_content_hash
 from pathlib import Path
 
 def assign_global_index(new_index):
@@ -21,41 +36,366 @@ def assign_global_index(new_index):
     config_module = sys.modules.get('app.config')
     if config_module:
         config_module.index = new_index
+        config_module.index_version += 1
         return True
     return False
 
+def bump_index_version():
+    from app import config
+    config.index_version += 1
+
+def resolve_index_type(n_vectors):
+    if INDEX_TYPE != "auto":
+        return INDEX_TYPE
+    return ANN_INDEX_TYPE if n_vectors >= ANN_MIN_VECTORS else "flat"
+
+def get_index_metric():
+    import faiss
+    return faiss.METRIC_INNER_PRODUCT if INDEX_METRIC == "ip" else faiss.METRIC_L2
+
+def index_descriptor(index_type):
+    return f"{index_type}:{INDEX_METRIC}"
+
+def get_index_type(current_index):
+    import faiss
+    base = current_index
+    if isinstance(current_index, faiss.IndexIDMap2):
+        base = faiss.downcast_index(current_index.index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+def create_index(dimension, n_vectors=0, training_vectors=None):
+    import faiss
+    index_type = resolve_index_type(n_vectors)
+    metric = get_index_metric()
+    
+    if index_type == "ivf":
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        nlist = min(IVF_NLIST, n_train // IVF_MIN_POINTS_PER_LIST)
+        if nlist < 1:
+            print(f"Pas assez de vecteurs pour entraîner un index IVF ({n_train}), index plat utilisé")
+            index_type = "flat"
+        else:
+            base = faiss.index_factory(dimension, f"IVF{nlist},Flat", metric)
+            base.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+            base.set_direct_map_type(faiss.DirectMap.Array)
+    
+    if index_type == "hnsw":
+        base = faiss.index_factory(dimension, f"HNSW{HNSW_M},Flat", metric)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "flat":
+        base = faiss.index_factory(dimension, "Flat", metric)
+    
+    return faiss.IndexIDMap2(base)
+
+def build_index(vectors, ids):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    training_vectors = None
+    if resolve_index_type(len(vectors)) == "ivf":
+        sample_size = min(len(vectors), IVF_NLIST * 64)
+        sample = np.random.default_rng(0).choice(len(vectors), size=sample_size, replace=False)
+        training_vectors = vectors[np.sort(sample)]
+    new_index = create_index(vectors.shape[1], len(vectors), training_vectors)
+    new_index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    return new_index
+
+def add_to_index(current_index, vectors, ids):
+    with index_lock.write():
+        current_index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+
+def commit_rows(current_index, vectors, ids, spans, metadata, texts, signatures):
+    with segment_store.lock:
+        add_to_index(current_index, vectors, ids)
+        segment_store.stage_vectors(vectors)
+        chunks.add_spans(*spans)
+        chunk_metadata.extend(metadata)
+        chunk_ids.extend(ids)
+        dedup_index.add_many(ids, signatures)
+        lexical_index.add_many(ids, texts)
+
+def reconstruct_vectors(current_index, ids):
+    with index_lock.read():
+        return current_index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+def refresh_index_snapshot(current_index):
+    index_type = get_index_type(current_index)
+    if index_type == "flat":
+        return False
+    with segment_store.lock, index_lock.read():
+        if not segment_store.snapshot_is_stale(SNAPSHOT_REFRESH_RATIO):
+            return False
+        return segment_store.write_index_snapshot(current_index, index_descriptor(index_type))
+
+async def maybe_upgrade_index():
+    from app import config
+    current_index = config.index
+    if current_index is None:
+        return False
+    current_type = get_index_type(current_index)
+    wanted_type = resolve_index_type(current_index.ntotal)
+    if current_type == wanted_type:
+        return False
+    if wanted_type == "ivf" and current_index.ntotal < IVF_MIN_POINTS_PER_LIST:
+        return False
+    
+    print(f"Passage de l'index {current_type} à {wanted_type} ({current_index.ntotal} vecteurs)")
+    ids = np.array(chunk_ids, dtype=np.int64)
+    vectors = await asyncio.to_thread(reconstruct_vectors, current_index, ids)
+    new_index = await asyncio.to_thread(build_index, vectors, ids)
+    assign_global_index(new_index)
+    return True
+
+def allocate_chunk_ids(count):
+    from app import config
+    start = config.next_chunk_id
+    config.next_chunk_id += count
+    return list(range(start, start + count))
+
+def get_chunk_position(chunk_id):
+    pos = bisect.bisect_left(chunk_ids, chunk_id)
+    if pos < len(chunk_ids) and chunk_ids[pos] == chunk_id:
+        return pos
+    return None
+
+def tombstone_chunks(ids_to_delete):
+    count = 0
+    for chunk_id in ids_to_delete:
+        pos = get_chunk_position(chunk_id)
+        if pos is None or chunk_id in deleted_chunk_ids:
+            continue
+        chunk_metadata[pos]["deleted"] = True
+        deleted_chunk_ids.add(chunk_id)
+        count += 1
+    if count:
+        bump_index_version()
+    return count
+
+def promote_alias(chunk_id):
+    promoted = processed_docs.promote_alias(chunk_id)
+    if promoted is None:
+        return False
+    doc, page = promoted
+    pos = get_chunk_position(chunk_id)
+    if pos is not None:
+        apply_chunk_owner(pos, doc["filename"], page)
+    bump_index_version()
+    return True
+
+def apply_chunk_owner(pos, filename, page):
+    meta = chunk_metadata[pos]
+    meta["source"] = filename
+    meta["page"] = page
+    meta["type"] = get_file_type(filename)
+
+def apply_promotions():
+    for doc in processed_docs:
+        for chunk_id, page in doc.get("promoted", []):
+            pos = get_chunk_position(chunk_id)
+            if pos is not None:
+                apply_chunk_owner(pos, doc["filename"], page)
+
+def register_document(doc):
+    with segment_store.lock:
+        processed_docs.add(doc)
+
+def remove_document(filename):
+    with segment_store.lock:
+        removed = processed_docs.remove(filename)
+        if removed is None:
+            return None
+        dead = [cid for cid in removed["chunks"] if not promote_alias(cid)]
+        count = tombstone_chunks(dead)
+    promoted = len(removed["chunks"]) - len(dead)
+    print(f"Document {filename} retiré, {count} chunks marqués comme supprimés, {promoted} transférés à des doublons")
+    return removed
+
+def get_dedup_ratio(doc):
+    aliased = len(doc.get("aliases", []))
+    total = aliased + len(doc["chunks"])
+    return aliased / total if total else 0.0
+
+def backfill_token_counts():
+    missing = np.flatnonzero(chunk_metadata.tokens == 0)
+    for pos in missing:
+        chunk_metadata[int(pos)]["tokens"] = count_tokens(chunks[int(pos)])
+    if len(missing):
+        print(f"Nombre de tokens calculé pour {len(missing)} chunks existants")
+    return len(missing)
+
+def get_dead_ratio():
+    if not chunks:
+        return 0.0
+    return len(deleted_chunk_ids) / len(chunks)
+
+def save_state(current_index=None):
+    from app import config
+    with segment_store.lock, index_lock.read():
+        segment_store.check_writable(len(chunks))
+        rewrite = segment_store.rewrite_pending
+        extras = {
+            "lexical": lexical_index.segment_arrays(rewrite),
+            "lsh": dedup_index.segment_arrays(rewrite)
+        }
+        segment_store.save(
+            chunks, chunk_metadata, chunk_ids, processed_docs,
+            deleted_chunk_ids, config.next_chunk_id, current_index, extras
+        )
+        if chunk_ids:
+            lexical_index.mark_saved(chunk_ids[-1])
+            dedup_index.mark_saved(chunk_ids[-1])
+
+def load_legacy_index_and_data():
+    import faiss
+    if PROCESSED_DOCS_FILE.exists():
+        with open(PROCESSED_DOCS_FILE, 'r') as f:
+            processed_docs.load(json.load(f))
+    
+    if not (INDEX_FILE.exists() and CHUNKS_FILE.exists() and METADATA_FILE.exists()):
+        return None
+    
+    loaded_index = faiss.read_index(str(INDEX_FILE))
+    
+    with open(CHUNKS_FILE, 'rb') as f:
+        loaded_chunks = pickle.load(f)
+    with open(METADATA_FILE, 'rb') as f:
+        loaded_meta = pickle.load(f)
+    
+    chunks.open()
+    chunks.extend_texts(loaded_chunks)
+    
+    chunk_metadata.clear()
+    chunk_metadata.extend(loaded_meta)
+    
+    from app import config
+    chunk_ids[:] = range(len(chunks))
+    config.next_chunk_id = len(chunks)
+    deleted_chunk_ids.clear()
+    deleted_chunk_ids.update(int(i) for i in np.flatnonzero(chunk_metadata.deleted))
+    lexical_index.rebuild(chunk_ids, chunks)
+    backfill_token_counts()
+    
+    if loaded_index.ntotal != len(chunks):
+        print(f"ATTENTION: Désynchro index ({loaded_index.ntotal}) vs chunks ({len(chunks)}), reconstruction nécessaire")
+        return None
+    
+    vectors = loaded_index.reconstruct_n(0, loaded_index.ntotal)
+    faiss.normalize_L2(vectors)
+    id_index = build_index(vectors, chunk_ids)
+    
+    print("Migration de l'ancien format vers le stockage segmenté...")
+    segment_store.mark_rewrite(vectors)
+    save_state()
+    for legacy_file in (INDEX_FILE, CHUNKS_FILE, METADATA_FILE, PROCESSED_DOCS_FILE):
+        legacy_file.unlink(missing_ok=True)
+    return id_index
+
+def load_segmented_index_and_data():
+    from app import config
+    manifest = segment_store.load_manifest()
+    docs, tombstones = segment_store.load_registry()
+    processed_docs.load(docs)
+    if manifest["text_blob"]:
+        chunks.open(manifest["text_blob"]["name"], manifest["text_blob"]["size"])
+    else:
+        chunks.open()
+    chunk_metadata.clear()
+    chunk_ids.clear()
+    deleted_chunk_ids.clear()
+    dedup_index.clear()
+    lexical_index.clear()
+    
+    if not manifest["segments"]:
+        return None
+    
+    total_rows = segment_store.total_rows()
+    wanted_type = resolve_index_type(total_rows)
+    covered_rows = 0
+    snapshot = segment_store.read_index_snapshot()
+    if snapshot is not None and snapshot[1]["type"] == index_descriptor(wanted_type):
+        loaded_index, covered_rows = snapshot[0], snapshot[1]["rows"]
+        print(f"Instantané de l'index chargé ({covered_rows} vecteurs)")
+    else:
+        training_vectors = None
+        if wanted_type == "ivf":
+            training_vectors = segment_store.sample_vectors(IVF_NLIST * 64)
+        loaded_index = create_index(manifest["dimension"], total_rows, training_vectors)
+    
+    row = 0
+    needs_migration = False
+    for vectors, seg_chunks, seg_meta, seg_ids in segment_store.iter_segments():
+        seg_rows = column_rows(seg_meta)
+        skip = min(max(covered_rows - row, 0), seg_rows)
+        if skip < seg_rows:
+            loaded_index.add_with_ids(np.ascontiguousarray(vectors[skip:]), seg_ids[skip:])
+        row += seg_rows
+        if isinstance(seg_chunks, list):
+            chunks.extend_texts(seg_chunks)
+            needs_migration = True
+        else:
+            chunks.add_spans(*seg_chunks)
+        if isinstance(seg_meta, dict):
+            chunk_metadata.extend_columns(seg_meta)
+        else:
+            chunk_metadata.extend(seg_meta)
+            needs_migration = True
+        chunk_ids.extend(int(cid) for cid in seg_ids)
+    config.next_chunk_id = max(manifest["next_chunk_id"], chunk_ids[-1] + 1 if chunk_ids else 0)
+    
+    tombstone_chunks(tombstones)
+    apply_promotions()
+    if backfill_token_counts():
+        needs_migration = True
+    lsh_parts = segment_store.read_extras("lsh")
+    if lsh_parts is not None:
+        dedup_index.load_segments(lsh_parts)
+    else:
+        dedup_index.load()
+        needs_migration = True
+    lexical_parts = segment_store.read_extras("lexical")
+    if lexical_parts is not None:
+        lexical_index.load_segments(lexical_parts)
+    else:
+        lexical_index.load()
+        needs_migration = True
+    if lexical_index.doc_count != len(chunk_ids):
+        lexical_index.rebuild(chunk_ids, chunks)
+        needs_migration = True
+    if needs_migration:
+        print("Migration des segments vers le stockage mappé en mémoire, les métadonnées en colonnes et les index par segment...")
+        segment_store.mark_rewrite(loaded_index.reconstruct_batch(np.array(chunk_ids, dtype=np.int64)))
+        save_state(loaded_index)
+        for legacy_file in (LEXICAL_INDEX_FILE, DEDUP_INDEX_FILE):
+            legacy_file.unlink(missing_ok=True)
+    refresh_index_snapshot(loaded_index)
+    return loaded_index
+
 def load_index_and_data():
     try:
-        if PROCESSED_DOCS_FILE.exists():
-            with open(PROCESSED_DOCS_FILE, 'r') as f:
-                processed_docs[:] = json.load(f)
+        if not segment_store.exists():
+            chunks.open()
+        if segment_store.exists():
+            loaded_index = load_segmented_index_and_data()
+        else:
+            loaded_index = load_legacy_index_and_data()
         
-        if INDEX_FILE.exists() and CHUNKS_FILE.exists() and METADATA_FILE.exists():
-            loaded_index = faiss.read_index(str(INDEX_FILE))
-            
-            with open(CHUNKS_FILE, 'rb') as f:
-                loaded_chunks = pickle.load(f)
-            with open(METADATA_FILE, 'rb') as f:
-                loaded_meta = pickle.load(f)
-            
-            chunks.clear()
-            chunks.extend(loaded_chunks)
-            
-            chunk_metadata.clear()
-            chunk_metadata.extend(loaded_meta)
-            
-            print(f"Index et données chargés ({len(chunks)} chunks, {len(processed_docs)} documents)")
-            
-            if loaded_index.ntotal != len(chunks):
-                print(f"ATTENTION: Désynchro index ({loaded_index.ntotal}) vs chunks ({len(chunks)})")
-            
+        if loaded_index is not None:
+            print(f"Index et données chargés ({len(chunks)} chunks, {len(processed_docs)} documents, {len(segment_store.manifest['segments'])} segments)")
             assign_global_index(loaded_index)
             return loaded_index
     except Exception as e:
         print(f"Erreur lors du chargement: {str(e)}")
         chunks.clear()
         chunk_metadata.clear()
+        chunk_ids.clear()
+        deleted_chunk_ids.clear()
         processed_docs.clear()
+        lexical_index.clear()
+        dedup_index.clear()
+        segment_store.reset(load_failed=True)
+        raise
     
     return None
 
@@ -68,22 +408,10 @@ def save_index_and_data():
     
     if current_index is not None and len(chunks) > 0:
         try:
-            print(f"Sauvegarde de l'index dans {INDEX_FILE}")
-            faiss.write_index(current_index, str(INDEX_FILE))
-            
-            print(f"Sauvegarde des chunks dans {CHUNKS_FILE}")
-            with open(CHUNKS_FILE, 'wb') as f:
-                pickle.dump(chunks, f)
-            
-            print(f"Sauvegarde des métadonnées dans {METADATA_FILE}")
-            with open(METADATA_FILE, 'wb') as f:
-                pickle.dump(chunk_metadata, f)
-            
-            print(f"Sauvegarde des documents traités dans {PROCESSED_DOCS_FILE}")
-            with open(PROCESSED_DOCS_FILE, 'w') as f:
-                json.dump(processed_docs, f, indent=2)
-            
-            print(f"Index et données sauvegardés ({len(chunks)} chunks, {len(processed_docs)} documents)")
+            new_rows = len(chunks) - segment_store.persisted_rows
+            save_state(current_index)
+            refresh_index_snapshot(current_index)
+            print(f"Index et données sauvegardés ({new_rows} nouveaux chunks, {len(chunks)} chunks, {len(processed_docs)} documents)")
             return True
         except Exception as e:
             print(f"Erreur lors de la sauvegarde: {str(e)}")
@@ -95,53 +423,47 @@ def save_index_and_data():
         return False
 
 def debug_chunks_info(filename):
-    matching_docs = [doc for doc in processed_docs if doc["filename"] == filename]
+    doc = processed_docs.get(filename)
     
-    if not matching_docs:
+    if doc is None:
         print(f"Aucun document trouvé: {filename}")
         return
-    
-    doc = matching_docs[0]
+
     print(f"\nInfos document '{filename}':")
     print(f"Hash: {doc['hash']}")
     print(f"Chunks: {len(doc['chunks'])} indices")
     
-    invalid_chunks = [idx for idx in doc["chunks"] if idx >= len(chunks)]
+    invalid_chunks = [cid for cid in doc["chunks"] if get_chunk_position(cid) is None]
     if invalid_chunks:
-        print(f"ATTENTION: {len(invalid_chunks)} indices invalides: {invalid_chunks[:5]}...")
+        print(f"ATTENTION: {len(invalid_chunks)} identifiants invalides: {invalid_chunks[:5]}...")
     
     sample_size = min(3, len(doc['chunks']))
     for i in range(sample_size):
-        c_idx = doc['chunks'][i]
-        if c_idx < len(chunks):
+        chunk_id = doc['chunks'][i]
+        c_idx = get_chunk_position(chunk_id)
+        if c_idx is not None:
             text = chunks[c_idx]
             meta = chunk_metadata[c_idx] if c_idx < len(chunk_metadata) else "Pas de métadonnées"
-            print(f"\nChunk #{i+1} (index {c_idx}):")
+            print(f"\nChunk #{i+1} (id {chunk_id}, position {c_idx}):")
             print(f"Métadonnées: {meta}")
             print(f"Texte (100 premiers chars): {text[:100]}...")
         else:
-            print(f"Index {c_idx} hors limites")
+            print(f"Chunk {chunk_id} introuvable")
 
-def process_existing_chunks():
+async def process_existing_chunks():
+    import faiss
     if not chunks:
         return False
     
     try:
-        embeddings = []
-        batch_size = 10
-        
-        for i in range(0, len(chunks), batch_size):
-            batch_text = chunks[i:i + batch_size]
-            resp = client.embeddings(model="mistral-embed", input=batch_text)
-            batch_embeddings = [item.embedding for item in resp.data]
-            embeddings.extend(batch_embeddings)
+        processing_status["chunks_embedded"] = 0
+        embeddings = await embedding_engine.embed(list(chunks))
         
         if embeddings:
-            dim = len(embeddings[0])
-            new_index = faiss.IndexFlatL2(dim)
             embeddings_np = np.array(embeddings).astype('float32')
             faiss.normalize_L2(embeddings_np)
-            new_index.add(embeddings_np)
+            new_index = await asyncio.to_thread(build_index, embeddings_np, chunk_ids)
+            segment_store.mark_rewrite(embeddings_np)
             
             assign_global_index(new_index)
             return True
@@ -149,137 +471,294 @@ def process_existing_chunks():
         print(f"Erreur reconstruction index: {str(e)}")
     return False
 
-async def process_files_in_background(files_content, filenames, file_paths):
+def next_blob_name(blob_name):
+    number = int(blob_name.split("_")[1].split(".")[0])
+    return f"texts_{number + 1:06d}.bin"
 
+def build_compacted_index(current_index, dead_ids):
+    keep = [pos for pos, cid in enumerate(chunk_ids) if cid not in dead_ids]
+    kept_ids = [chunk_ids[pos] for pos in keep]
+    vectors = reconstruct_vectors(current_index, kept_ids)
+    new_index = build_index(vectors, kept_ids)
+    blob_name = next_blob_name(chunks.blob_name)
+    offsets, lengths, blob_size = chunks.build_compacted(keep, blob_name)
+    return (
+        new_index,
+        vectors,
+        (blob_name, offsets, lengths, blob_size),
+        chunk_metadata.take(keep),
+        kept_ids
+    )
+
+def apply_compaction(new_index, vectors, new_texts, new_meta, new_ids, dead_ids):
+    with segment_store.lock, index_lock.write():
+        chunks.swap(*new_texts)
+        chunk_metadata.replace(new_meta)
+        chunk_ids[:] = new_ids
+        deleted_chunk_ids.difference_update(dead_ids)
+        dedup_index.discard(dead_ids)
+        lexical_index.discard(dead_ids)
+        assign_global_index(new_index)
+        segment_store.mark_rewrite(vectors)
+
+async def compact_index(force=False):
     from app import config
+    
+    ratio = get_dead_ratio()
+    if config.index is None or not deleted_chunk_ids:
+        return False
+    if not force and ratio < COMPACTION_THRESHOLD:
+        return False
+    if processing_status["is_processing"]:
+        print("Compactage reporté: un traitement est en cours")
+        return False
+    
+    processing_status["is_processing"] = True
+    try:
+        dead_ids = set(deleted_chunk_ids)
+        print(f"Compactage de l'index: {len(dead_ids)} chunks supprimés ({ratio:.1%})")
+        new_index, vectors, new_texts, new_meta, new_ids = await asyncio.to_thread(
+            build_compacted_index, config.index, dead_ids
+        )
+        await asyncio.to_thread(apply_compaction, new_index, vectors, new_texts, new_meta, new_ids, dead_ids)
+        await asyncio.to_thread(save_index_and_data)
+        print(f"Compactage terminé: {new_index.ntotal} vecteurs")
+        return True
+    except Exception as e:
+        print(f"Erreur lors du compactage: {str(e)}")
+        traceback.print_exc()
+        return False
+    finally:
+        processing_status["is_processing"] = False
 
+def get_file_type(filename):
+    filename = filename.lower()
+    if filename.endswith('.pdf'):
+        return 'pdf'
+    if filename.endswith('.html'):
+        return 'html'
+    return 'txt'
+
+async def extract_file_chunks(filename, file_path):
+    pool = get_extraction_pool(EXTRACTION_WORKERS)
+    try:
+        return await run_extraction(pool, filename, file_path)
+    except BrokenProcessPool:
+        shutdown_extraction_pool(pool)
+        print(f"Pool d'extraction interrompu pendant {filename}, nouvel essai dans un processus isolé")
+    
+    isolated_pool = new_extraction_pool(1)
+    try:
+        return await run_extraction(isolated_pool, filename, file_path)
+    finally:
+        isolated_pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_extraction(pool, filename, file_path):
+    loop = asyncio.get_running_loop()
+    file_path = str(file_path)
+    
+    file_type = get_file_type(filename)
+    
+    if file_type == 'pdf':
+        num_pages = await loop.run_in_executor(pool, count_pdf_pages, file_path)
+        print(f"Traitement PDF: {filename}, {num_pages} pages")
+        page_ranges = [
+            (start, min(start + PDF_PAGES_PER_TASK, num_pages))
+            for start in range(0, num_pages, PDF_PAGES_PER_TASK)
+        ]
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(pool, extract_pdf_chunks, file_path, start, end, CHUNK_SIZE, CHUNK_OVERLAP)
+            for start, end in page_ranges
+        ))
+        return merge_extracted(parts)
+    
+    if file_type == 'html' or filename.lower().endswith('.txt'):
+        print(f"Traitement {file_type.upper()}: {filename}")
+        return await loop.run_in_executor(pool, extract_text_chunks, file_path, CHUNK_SIZE, CHUNK_OVERLAP)
+    
+    return {"data": b"", "chunks": []}
+
+async def index_document(filename, file_hash, extracted):
+    import faiss
+    from app import config
+    
+    file_type = get_file_type(filename)
+    doc_data = extracted["data"]
+    doc_texts = [
+        doc_data[item["byte_start"]:item["byte_start"] + item["byte_length"]].decode('utf-8', errors='replace')
+        for item in extracted["chunks"]
+    ]
+    if DEDUP_ENABLED:
+        doc_signatures = await asyncio.to_thread(minhash_many, doc_texts)
+    else:
+        doc_signatures = [None] * len(doc_texts)
+    
+    new_chunks = []
+    new_items = []
+    new_chunk_metadata = []
+    new_chunk_ids = []
+    new_signatures = []
+    doc_buckets = {}
+    doc_chunk_texts = {}
+    
+    def text_for_id(chunk_id):
+        if chunk_id in doc_chunk_texts:
+            return doc_chunk_texts[chunk_id]
+        pos = get_chunk_position(chunk_id)
+        if pos is None or chunk_id in deleted_chunk_ids:
+            return None
+        return chunks[pos]
+    
+    current_file_aliases = []
+    for item, text, signature in zip(extracted["chunks"], doc_texts, doc_signatures):
+        duplicate_of = find_duplicate(signature, dedup_index, doc_buckets, text_for_id)
+        if duplicate_of is not None:
+            current_file_aliases.append([duplicate_of, item.get("page")])
+            processing_status["chunks_deduplicated"] += 1
+            continue
+        chunk_id = allocate_chunk_ids(1)[0]
+        new_chunk_ids.append(chunk_id)
+        new_signatures.append(signature)
+        doc_chunk_texts[chunk_id] = text
+        if signature is not None:
+            for key in band_keys(signature):
+                doc_buckets.setdefault(int(key), []).append(chunk_id)
+        new_chunks.append(text)
+        new_items.append(item)
+        meta = {"source": filename}
+        if "page" in item:
+            meta["page"] = item["page"]
+        meta.update({
+            "type": file_type,
+            "start_char": item["start_char"],
+            "length": item["length"],
+            "tokens": item["tokens"],
+            "deleted": False
+        })
+        new_chunk_metadata.append(meta)
+        processing_status["chunks_created"] += 1
+    
+    if new_chunks:
+        doc_offset = chunks.append_document(doc_data)
+        new_chunk_spans = (
+            [doc_offset + item["byte_start"] for item in new_items],
+            [item["byte_length"] for item in new_items]
+        )
+        embeddings = await embedding_engine.embed(new_chunks)
+        embeddings_np = np.array(embeddings).astype('float32')
+        faiss.normalize_L2(embeddings_np)
+        await asyncio.to_thread(
+            commit_rows, config.index, embeddings_np, new_chunk_ids,
+            new_chunk_spans, new_chunk_metadata, new_chunks, new_signatures
+        )
+        bump_index_version()
+        await maybe_upgrade_index()
+    
+    new_doc = {
+        "filename": filename,
+        "hash": file_hash,
+        "chunks": new_chunk_ids,
+        "aliases": current_file_aliases
+    }
+    await asyncio.to_thread(register_document, new_doc)
+    print(f"Document {filename}, {len(new_chunk_ids)} chunks, {len(current_file_aliases)} doublons ({get_dedup_ratio(new_doc):.1%})")
+    return new_doc
+
+async def process_files_in_background(filenames, file_paths, file_hashes=None):
+    from app import config
+    
+    extraction_tasks = {}
     try:
         processing_status["is_processing"] = True
-        processing_status["total_files"] = len(files_content)
+        processing_status["total_files"] = len(filenames)
         processing_status["processed_files"] = 0
         processing_status["chunks_created"] = 0
+        processing_status["chunks_embedded"] = 0
+        processing_status["chunks_deduplicated"] = 0
+        processing_status["embedding_throughput"] = 0.0
         
         if config.index is None and chunks:
-            process_existing_chunks()
+            await process_existing_chunks()
         elif config.index is None:
             vector_dimension = 1024
-            config.index = faiss.IndexFlatL2(vector_dimension)
+            config.index = create_index(vector_dimension)
         
-        new_chunks = []
-        new_chunk_metadata = []
-        embeddings = []
+        to_extract = []
+        if file_hashes is None:
+            file_hashes = [None] * len(filenames)
         
-        for (content, filename, file_path) in zip(files_content, filenames, file_paths):
-            file_hash = calculate_content_hash(content)
-            existing_doc_index = None
-            for j, doc in enumerate(processed_docs):
-                if doc["filename"] == filename:
-                    existing_doc_index = j
-                    break
+        queued = set()
+        for (filename, file_path, file_hash) in zip(filenames, file_paths, file_hashes):
+            if filename in queued:
+                print(f"Fichier {filename} présent plusieurs fois dans le lot, doublon ignoré.")
+                processing_status["processed_files"] += 1
+                continue
+            if file_hash is None:
+                file_hash = await asyncio.to_thread(calculate_file_hash, file_path)
+            existing_doc = processed_docs.get(filename)
             
-            if existing_doc_index is not None:
-                if processed_docs[existing_doc_index]["hash"] == file_hash:
+            if existing_doc is not None:
+                if existing_doc["hash"] == file_hash:
                     print(f"Fichier {filename} inchangé, ignoré.")
                     processing_status["processed_files"] += 1
                     continue
                 else:
                     print(f"Fichier {filename} modifié, suppression ancienne version.")
-                    processed_docs.pop(existing_doc_index)
+                    await asyncio.to_thread(remove_document, filename)
             
-            start_idx = len(chunks)
-            current_file_chunks = []
-            
-            if filename.endswith('.pdf'):
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-                print(f"Traitement PDF: {filename}, {len(pdf_reader.pages)} pages")
-                
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text() or ""
-                    if not page_text.strip():
-                        print(f"Page {page_num+1} vide dans {filename}")
-                        continue
-                    for i in range(0, len(page_text), CHUNK_SIZE - CHUNK_OVERLAP):
-                        chunk_text = page_text[i:i+CHUNK_SIZE]
-                        if chunk_text.strip():
-                            new_chunks.append(chunk_text)
-                            current_file_chunks.append(len(chunks) + len(new_chunks) - 1)
-                            new_chunk_metadata.append({
-                                "source": filename,
-                                "page": page_num + 1,
-                                "type": "pdf",
-                                "start_char": i,
-                                "length": len(chunk_text),
-                                "deleted": False
-                            })
-                            processing_status["chunks_created"] += 1
-            
-            elif filename.endswith('.txt') or filename.endswith('.html'):
-                text = content.decode('utf-8', errors='ignore')
-                file_type = 'txt' if filename.endswith('.txt') else 'html'
-                print(f"Traitement {file_type.upper()}: {filename}, {len(text)} caractères")
-                
-                if len(text.strip()) == 0:
-                    print(f"Fichier {filename} vide ou ne contenant que des espaces")
-                    processing_status["processed_files"] += 1
-                    continue
-                    
-                for i in range(0, len(text), CHUNK_SIZE - CHUNK_OVERLAP):
-                    chunk_text = text[i:i+CHUNK_SIZE]
-                    if chunk_text.strip():
-                        new_chunks.append(chunk_text)
-                        current_file_chunks.append(len(chunks) + len(new_chunks) - 1)
-                        new_chunk_metadata.append({
-                            "source": filename,
-                            "type": file_type,
-                            "start_char": i,
-                            "length": len(chunk_text),
-                            "deleted": False
-                        })
-                        processing_status["chunks_created"] += 1
-
-            new_doc = {
-                "filename": filename,
-                "hash": file_hash,
-                "chunks": current_file_chunks
-            }
-            processed_docs.append(new_doc)
-            print(f"Document {filename}, {len(current_file_chunks)} chunks")
-            processing_status["processed_files"] += 1
+            same_content = [doc["filename"] for doc in processed_docs.find_by_hash(file_hash)]
+            if same_content:
+                print(f"Fichier {filename} identique à {', '.join(same_content)}")
+            queued.add(filename)
+            to_extract.append((filename, file_path, file_hash))
+        
+        def schedule_extractions(first):
+            for i in range(first, min(first + INGEST_EXTRACTION_WINDOW, len(to_extract))):
+                if i not in extraction_tasks:
+                    filename, file_path, _ = to_extract[i]
+                    extraction_tasks[i] = asyncio.ensure_future(extract_file_chunks(filename, file_path))
         
-        if new_chunks:
-            print(f"Vectorisation de {len(new_chunks)} chunks...")
-            batch_size = 10
-            for i in range(0, len(new_chunks), batch_size):
-                batch_end = i + batch_size
-                batch_text = new_chunks[i:batch_end]
-                resp = client.embeddings(model="mistral-embed", input=batch_text)
-                batch_embeddings = [item.embedding for item in resp.data]
-                embeddings.extend(batch_embeddings)
-                print(f"Lot {i//batch_size + 1} vectorisé")
+        for i, (filename, file_path, file_hash) in enumerate(to_extract):
+            schedule_extractions(i)
+            try:
+                extracted = await extraction_tasks.pop(i)
+            except Exception as e:
+                print(f"Erreur lors de l'extraction de {filename}: {str(e)}")
+                processing_status["processed_files"] += 1
+                continue
             
-            chunks.extend(new_chunks)
-            chunk_metadata.extend(new_chunk_metadata)
+            if get_file_type(filename) in ('txt', 'html') and not extracted["chunks"]:
+                print(f"Fichier {filename} vide ou ne contenant que des espaces")
+                processing_status["processed_files"] += 1
+                continue
             
-            if embeddings:
-                embeddings_np = np.array(embeddings).astype('float32')
-                faiss.normalize_L2(embeddings_np)
-                config.index.add(embeddings_np)
-                print(f"Index mis à jour, {config.index.ntotal} vecteurs")
-                result = save_index_and_data()
-                if result:
-                    print("Données sauvegardées avec succès.")
-                else:
-                    print("ERREUR: Échec de la sauvegarde des données!")
+            try:
+                await index_document(filename, file_hash, extracted)
+            except Exception as e:
+                print(f"Erreur lors de l'indexation de {filename}: {str(e)}")
+                traceback.print_exc()
+                processing_status["processed_files"] += 1
+                continue
+            del extracted
+            
+            if await asyncio.to_thread(save_index_and_data):
+                print(f"Données sauvegardées avec succès ({filename}).")
+            else:
+                print(f"ERREUR: Échec de la sauvegarde des données après {filename}!")
+            processing_status["processed_files"] += 1
     except Exception as e:
         print(f"Erreur process background: {str(e)}")
         traceback.print_exc()
     finally:
+        for task in extraction_tasks.values():
+            task.cancel()
         processing_status["is_processing"] = False
+    
+    await compact_index()
 
 async def process_web_content(base_url: str, max_pages: int = 50):
     from app.web_scraper import WebScraper
     from app.config import processing_status, CHUNK_SIZE, CHUNK_OVERLAP
-    from app.utils import calculate_content_hash
     
     try:
         scraper = WebScraper(base_url)
@@ -291,33 +770,35 @@ async def process_web_content(base_url: str, max_pages: int = 50):
             print("Aucune page n'a été trouvée ou extraite.")
             return False
         
+        crawled_pages = scraper.remove_boilerplate(crawled_pages)
+        if not crawled_pages:
+            print("Aucune page ne contient de contenu propre après nettoyage.")
+            processing_status["is_processing"] = False
+            return False
+        
         print(f"{len(crawled_pages)} pages extraites. Sauvegarde en cours...")
         saved_files = scraper.save_pages_as_files(crawled_pages)
         
-        files_content = []
         filenames = []
         file_paths = []
         
         for file_info in saved_files:
-            with open(file_info["path"], "rb") as f:
-                content = f.read()
-                
-                if len(content) < 50:
-                    print(f"Fichier {file_info['filename']} ignoré car trop petit ({len(content)} octets)")
-                    continue
-                    
-            files_content.append(content)
+            file_size = Path(file_info["path"]).stat().st_size
+            if file_size < 50:
+                print(f"Fichier {file_info['filename']} ignoré car trop petit ({file_size} octets)")
+                continue
+            
             filenames.append(file_info["filename"])
             file_paths.append(file_info["path"])
         
-        if not files_content:
+        if not filenames:
             print("Aucun contenu valide à indexer.")
             processing_status["is_processing"] = False
             return False
             
-        print(f"Traitement de {len(files_content)} fichiers pour l'indexation...")
+        print(f"Traitement de {len(filenames)} fichiers pour l'indexation...")
 
-        await process_files_in_background(files_content, filenames, file_paths)
+        await process_files_in_background(filenames, file_paths)
         
         return True
     except Exception as e:
@@ -0,0 +1,102 @@
+class DocumentRegistry:
+    def __init__(self, docs=None):
+        self.clear()
+        if docs:
+            self.load(docs)
+
+    def clear(self):
+        self.by_filename = {}
+        self.by_hash = {}
+        self.by_chunk = {}
+        self.by_alias = {}
+        self.dirty = set()
+
+    def load(self, docs):
+        self.clear()
+        for doc in docs:
+            self.add(doc)
+        self.dirty.clear()
+
+    def add(self, doc):
+        filename = doc["filename"]
+        if filename in self.by_filename:
+            self.remove(filename)
+        self.by_filename[filename] = doc
+        self.dirty.add(filename)
+        self.by_hash.setdefault(doc["hash"], {})[filename] = doc
+        for chunk_id in doc["chunks"]:
+            self.by_chunk[chunk_id] = filename
+        for chunk_id, page in doc.get("aliases", []):
+            self.by_alias.setdefault(chunk_id, []).append((filename, page))
+        return doc
+
+    def remove(self, filename):
+        doc = self.by_filename.pop(filename, None)
+        if doc is None:
+            return None
+        self.dirty.add(filename)
+        same_hash = self.by_hash.get(doc["hash"], {})
+        same_hash.pop(filename, None)
+        if not same_hash:
+            self.by_hash.pop(doc["hash"], None)
+        for chunk_id in doc["chunks"]:
+            if self.by_chunk.get(chunk_id) == filename:
+                del self.by_chunk[chunk_id]
+        for chunk_id, page in doc.get("aliases", []):
+            aliases = self.by_alias.get(chunk_id, [])
+            if (filename, page) in aliases:
+                aliases.remove((filename, page))
+            if not aliases:
+                self.by_alias.pop(chunk_id, None)
+        return doc
+
+    def get(self, filename):
+        return self.by_filename.get(filename)
+
+    def find_by_hash(self, file_hash):
+        return list(self.by_hash.get(file_hash, {}).values())
+
+    def document_for_chunk(self, chunk_id):
+        filename = self.by_chunk.get(chunk_id)
+        if filename is None:
+            return None
+        return self.by_filename[filename]
+
+    def aliases_for(self, chunk_id):
+        return self.by_alias.get(chunk_id, [])
+
+    def promote_alias(self, chunk_id):
+        aliases = self.by_alias.get(chunk_id)
+        if not aliases:
+            return None
+        filename, page = aliases.pop(0)
+        if not aliases:
+            del self.by_alias[chunk_id]
+        doc = self.by_filename[filename]
+        doc["aliases"].remove([chunk_id, page])
+        doc["chunks"].append(chunk_id)
+        doc.setdefault("promoted", []).append([chunk_id, page])
+        self.by_chunk[chunk_id] = filename
+        self.dirty.add(filename)
+        return doc, page
+
+    def changes(self):
+        return {filename: self.by_filename.get(filename) for filename in list(self.dirty)}
+
+    def mark_clean(self, filenames):
+        self.dirty.difference_update(filenames)
+
+    def filenames(self):
+        return list(self.by_filename)
+
+    def to_list(self):
+        return list(self.by_filename.values())
+
+    def __contains__(self, filename):
+        return filename in self.by_filename
+
+    def __len__(self):
+        return len(self.by_filename)
+
+    def __iter__(self):
+        return iter(list(self.by_filename.values()))
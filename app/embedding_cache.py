@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import time
+import numpy as np
+
+from app.config import DATA_DIR, EMBEDDING_CACHE_FILE, EMBEDDING_CACHE_MAX_ENTRIES
+from app.utils import calculate_content_hash
+
+def text_hash(text):
+    return calculate_content_hash(text.encode('utf-8'))
+
+class EmbeddingCache:
+    def __init__(self, db_path=EMBEDDING_CACHE_FILE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._count = 0
+
+    def _connect(self):
+        if self._conn is None:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, "
+                "vector BLOB NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._conn
+
+    def get_many(self, model, hashes):
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        if not unique_hashes:
+            return found
+        with self.lock:
+            conn = self._connect()
+            for i in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                conn.commit()
+        self.hits += sum(1 for h in hashes if h in found)
+        self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model, items):
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (model, h, np.asarray(vec, dtype=np.float32).tobytes(), now)
+            for h, vec in items
+        ]
+        with self.lock:
+            conn = self._connect()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            self._count += conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+        self._conn.commit()
+        self._count -= excess
+        print(f"Cache d'embeddings: {excess} entrées évincées ({self._count} restantes)")
+
+    def stats(self):
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+import numpy as np
+from mistralai.exceptions import MistralAPIException
+
+from app.config import (
+    client, processing_status,
+    EMBEDDING_MODEL, EMBEDDING_CONCURRENCY,
+    EMBEDDING_MAX_BATCH_TOKENS, EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MAX_RETRIES, EMBEDDING_RETRY_BASE_DELAY
+)
+from app.embedding_cache import embedding_cache, text_hash
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def pack_batches(texts, max_tokens=EMBEDDING_MAX_BATCH_TOKENS, max_size=EMBEDDING_MAX_BATCH_SIZE):
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+class EmbeddingEngine:
+    def __init__(self, model=EMBEDDING_MODEL, concurrency=EMBEDDING_CONCURRENCY,
+                 max_retries=EMBEDDING_MAX_RETRIES, retry_base_delay=EMBEDDING_RETRY_BASE_DELAY):
+        self.model = model
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+    async def _embed_batch(self, semaphore, texts):
+        attempt = 0
+        while True:
+            async with semaphore:
+                try:
+                    resp = await asyncio.to_thread(client.embeddings, model=self.model, input=texts)
+                    return [item.embedding for item in resp.data]
+                except MistralAPIException as e:
+                    if e.http_status not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                        raise
+                    retry_after = e.headers.get("retry-after") if e.headers else None
+            attempt += 1
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.retry_base_delay * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+            print(f"Limite de débit atteinte, nouvel essai {attempt}/{self.max_retries} dans {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def embed(self, texts):
+        start_time = time.monotonic()
+        hashes = [text_hash(text) for text in texts]
+        vectors = await asyncio.to_thread(embedding_cache.get_many, self.model, hashes)
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors and h not in missing:
+                missing[h] = text
+
+        if vectors:
+            print(f"Cache d'embeddings: {len(texts) - len(missing)}/{len(texts)} chunks déjà vectorisés")
+
+        missing_hashes = list(missing.keys())
+        missing_texts = list(missing.values())
+        batches = pack_batches(missing_texts)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        embedded = len(texts) - len(missing)
+        processing_status["chunks_embedded"] += embedded
+
+        async def run_batch(batch_num, batch):
+            nonlocal embedded
+            batch_embeddings = await self._embed_batch(semaphore, [missing_texts[i] for i in batch])
+            items = [(missing_hashes[i], vec) for i, vec in zip(batch, batch_embeddings)]
+            await asyncio.to_thread(embedding_cache.put_many, self.model, items)
+            for h, vec in items:
+                vectors[h] = np.asarray(vec, dtype=np.float32)
+            embedded += len(batch)
+            processing_status["chunks_embedded"] += len(batch)
+            elapsed = time.monotonic() - start_time
+            if elapsed > 0:
+                processing_status["embedding_throughput"] = round(embedded / elapsed, 1)
+            print(f"Lot {batch_num + 1}/{len(batches)} vectorisé ({len(batch)} chunks)")
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                for n, batch in enumerate(batches):
+                    group.create_task(run_batch(n, batch))
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+
+        elapsed = time.monotonic() - start_time
+        if elapsed > 0:
+            processing_status["embedding_throughput"] = round(len(texts) / elapsed, 1)
+        print(f"{len(texts)} chunks vectorisés en {elapsed:.1f}s ({processing_status['embedding_throughput']} chunks/s)")
+
+        return [vectors[h] for h in hashes]
+
+embedding_engine = EmbeddingEngine()
@@ -0,0 +1,94 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.text_store import encode_text
+from app.tokens import count_tokens
+
+_pool = None
+
+def new_extraction_pool(max_workers):
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def get_extraction_pool(max_workers):
+    global _pool
+    if _pool is None:
+        _pool = new_extraction_pool(max_workers)
+    return _pool
+
+def shutdown_extraction_pool(pool=None):
+    global _pool
+    if pool is not None and pool is not _pool:
+        return
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def chunk_text(text, chunk_size, chunk_overlap):
+    result = []
+    for i in range(0, len(text), chunk_size - chunk_overlap):
+        chunk = text[i:i+chunk_size]
+        if chunk.strip():
+            result.append((i, chunk))
+    return result
+
+def chunk_spans(text, chunk_size, chunk_overlap, byte_base=0):
+    spans = []
+    prev_char = 0
+    prev_byte = 0
+    for start_char, chunk in chunk_text(text, chunk_size, chunk_overlap):
+        prev_byte += len(encode_text(text[prev_char:start_char]))
+        prev_char = start_char
+        spans.append({
+            "start_char": start_char,
+            "length": len(chunk),
+            "byte_start": byte_base + prev_byte,
+            "byte_length": len(encode_text(chunk)),
+            "tokens": count_tokens(chunk)
+        })
+    return spans
+
+def count_pdf_pages(file_path):
+    import PyPDF2
+    return len(PyPDF2.PdfReader(file_path).pages)
+
+def extract_pdf_chunks(file_path, start_page, end_page, chunk_size, chunk_overlap):
+    import PyPDF2
+    pdf_reader = PyPDF2.PdfReader(file_path)
+    parts = []
+    spans = []
+    byte_base = 0
+    for page_num in range(start_page, end_page):
+        page_text = pdf_reader.pages[page_num].extract_text() or ""
+        if not page_text.strip():
+            print(f"Page {page_num+1} vide dans {file_path}")
+            continue
+        page_spans = chunk_spans(page_text, chunk_size, chunk_overlap, byte_base)
+        for span in page_spans:
+            span["page"] = page_num + 1
+        spans.extend(page_spans)
+        page_data = encode_text(page_text)
+        parts.append(page_data)
+        byte_base += len(page_data)
+    return {"data": b"".join(parts), "chunks": spans}
+
+def extract_text_chunks(file_path, chunk_size, chunk_overlap):
+    with open(file_path, "rb") as f:
+        text = f.read().decode('utf-8', errors='ignore')
+    spans = chunk_spans(text, chunk_size, chunk_overlap)
+    if not spans:
+        return {"data": b"", "chunks": []}
+    return {"data": encode_text(text), "chunks": spans}
+
+def merge_extracted(parts):
+    data = []
+    spans = []
+    byte_base = 0
+    for part in parts:
+        for span in part["chunks"]:
+            spans.append({**span, "byte_start": span["byte_start"] + byte_base})
+        data.append(part["data"])
+        byte_base += len(part["data"])
+    return {"data": b"".join(data), "chunks": spans}
@@ -0,0 +1,207 @@
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+
+from app.config import LEXICAL_INDEX_FILE, BM25_K1, BM25_B
+
+MAX_TERM_LENGTH = 64
+
+def tokenize(text):
+    return [t for t in re.findall(r'\w+', text.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+def contains_phrase(text, phrase_tokens):
+    if not phrase_tokens:
+        return False
+    return f" {' '.join(phrase_tokens)} " in f" {' '.join(tokenize(text))} "
+
+def extend_postings(postings, part):
+    offsets = part["offsets"]
+    ids = part["ids"]
+    tfs = part["tfs"]
+    for i, term in enumerate(part["terms"].tolist()):
+        start, end = offsets[i], offsets[i + 1]
+        entry = postings.get(term)
+        if entry is None:
+            postings[term] = (array('q', ids[start:end].tobytes()), array('i', tfs[start:end].tobytes()))
+        else:
+            entry[0].frombytes(ids[start:end].tobytes())
+            entry[1].frombytes(tfs[start:end].tobytes())
+
+def flatten_postings(postings):
+    terms = list(postings)
+    sizes = np.fromiter((len(postings[t][0]) for t in terms), dtype=np.int64, count=len(terms))
+    return {
+        "terms": np.array(terms, dtype=str),
+        "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+        "ids": np.frombuffer(b"".join(postings[t][0].tobytes() for t in terms), dtype=np.int64),
+        "tfs": np.frombuffer(b"".join(postings[t][1].tobytes() for t in terms), dtype=np.int32)
+    }
+
+def merge_postings(parts):
+    postings = {}
+    for part in parts:
+        extend_postings(postings, part)
+    return {
+        **flatten_postings(postings),
+        "doc_ids": np.concatenate([part["doc_ids"] for part in parts]),
+        "lengths": np.concatenate([part["lengths"] for part in parts])
+    }
+
+class LexicalIndex:
+    def __init__(self, index_file=LEXICAL_INDEX_FILE, k1=BM25_K1, b=BM25_B):
+        self.index_file = index_file
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.postings = {}
+            self.lengths = np.zeros(0, dtype=np.int32)
+            self.doc_count = 0
+            self.total_length = 0
+            self.unsaved = []
+
+    def _ensure_capacity(self, max_id):
+        if max_id >= len(self.lengths):
+            grown = np.zeros(max(max_id + 1, len(self.lengths) * 2), dtype=np.int32)
+            grown[:len(self.lengths)] = self.lengths
+            self.lengths = grown
+
+    def add_many(self, chunk_ids, texts):
+        tokenized = [Counter(tokenize(text)) for text in texts]
+        with self.lock:
+            if chunk_ids:
+                self._ensure_capacity(max(chunk_ids))
+            for chunk_id, counts in zip(chunk_ids, tokenized):
+                length = max(sum(counts.values()), 1)
+                self.lengths[chunk_id] = length
+                self.doc_count += 1
+                self.total_length += length
+                self.unsaved.append((chunk_id, counts, length))
+                for term, tf in counts.items():
+                    entry = self.postings.get(term)
+                    if entry is None:
+                        entry = self.postings[term] = (array('q'), array('i'))
+                    entry[0].append(chunk_id)
+                    entry[1].append(tf)
+
+    def rebuild(self, chunk_ids, texts):
+        self.clear()
+        self.add_many(list(chunk_ids), texts)
+        self.unsaved = []
+        print(f"Index lexical reconstruit ({self.doc_count} chunks, {len(self.postings)} termes)")
+
+    def discard(self, dead_ids):
+        if not dead_ids:
+            return
+        dead = np.fromiter(dead_ids, dtype=np.int64, count=len(dead_ids))
+        with self.lock:
+            for term in list(self.postings):
+                ids, tfs = self.postings[term]
+                ids_np = np.frombuffer(ids, dtype=np.int64)
+                keep = ~np.isin(ids_np, dead)
+                if keep.all():
+                    continue
+                if not keep.any():
+                    del self.postings[term]
+                    continue
+                self.postings[term] = (
+                    array('q', ids_np[keep].tobytes()),
+                    array('i', np.frombuffer(tfs, dtype=np.int32)[keep].tobytes())
+                )
+            dead = dead[dead < len(self.lengths)]
+            removed = self.lengths[dead]
+            self.doc_count -= int(np.count_nonzero(removed))
+            self.total_length -= int(removed.sum())
+            self.lengths[dead] = 0
+
+    def search(self, tokens, k, excluded=(), allowed=None):
+        with self.lock:
+            if not self.doc_count:
+                return []
+            avg_length = self.total_length / self.doc_count
+            all_ids = []
+            all_scores = []
+            for term in set(tokens):
+                entry = self.postings.get(term)
+                if entry is None:
+                    continue
+                ids = np.frombuffer(entry[0], dtype=np.int64).copy()
+                tfs = np.frombuffer(entry[1], dtype=np.int32).astype(np.float32)
+                idf = math.log(1 + (self.doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / avg_length)
+                all_ids.append(ids)
+                all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not all_ids:
+            return []
+        unique_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if excluded:
+            alive = ~np.isin(unique_ids, np.fromiter(excluded, dtype=np.int64, count=len(excluded)))
+            unique_ids, scores = unique_ids[alive], scores[alive]
+        if allowed is not None:
+            keep = np.isin(unique_ids, allowed)
+            unique_ids, scores = unique_ids[keep], scores[keep]
+        if len(unique_ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(unique_ids))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(unique_ids[i]), float(scores[i])) for i in top]
+
+    def load(self):
+        self.clear()
+        if not self.index_file.exists():
+            return False
+        with np.load(self.index_file) as data:
+            part = {name: data[name] for name in ("terms", "offsets", "ids", "tfs", "lengths")}
+        with self.lock:
+            extend_postings(self.postings, part)
+            self.lengths = part["lengths"].astype(np.int32)
+            self.doc_count = int(np.count_nonzero(self.lengths))
+            self.total_length = int(self.lengths.sum())
+        print(f"Index lexical chargé ({self.doc_count} chunks, {len(self.postings)} termes)")
+        return True
+
+    def load_segments(self, parts):
+        self.clear()
+        with self.lock:
+            for part in parts:
+                extend_postings(self.postings, part)
+                doc_ids = part["doc_ids"]
+                if len(doc_ids):
+                    self._ensure_capacity(int(doc_ids.max()))
+                    self.lengths[doc_ids] = part["lengths"]
+            self.doc_count = int(np.count_nonzero(self.lengths))
+            self.total_length = int(self.lengths.sum())
+        print(f"Index lexical chargé depuis les segments ({self.doc_count} chunks, {len(self.postings)} termes)")
+
+    def segment_arrays(self, rewrite=False):
+        with self.lock:
+            if rewrite:
+                doc_ids = np.flatnonzero(self.lengths).astype(np.int64)
+                return {**flatten_postings(self.postings), "doc_ids": doc_ids, "lengths": self.lengths[doc_ids]}
+            postings = {}
+            for chunk_id, counts, _ in self.unsaved:
+                for term, tf in counts.items():
+                    entry = postings.get(term)
+                    if entry is None:
+                        entry = postings[term] = (array('q'), array('i'))
+                    entry[0].append(chunk_id)
+                    entry[1].append(tf)
+            return {
+                **flatten_postings(postings),
+                "doc_ids": np.array([chunk_id for chunk_id, _, _ in self.unsaved], dtype=np.int64),
+                "lengths": np.array([length for _, _, length in self.unsaved], dtype=np.int32)
+            }
+
+    def mark_saved(self, last_id):
+        with self.lock:
+            self.unsaved = [entry for entry in self.unsaved if entry[0] > last_id]
+
+lexical_index = LexicalIndex()
@@ -1,3 +1,5 @@
+import asyncio
+import time
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,7 +9,7 @@ from fastapi.responses import HTMLResponse
 from app.routes import router
 from app.doc_processing import load_index_and_data
 from app.session_manager import load_session_history, clean_expired_sessions
-from app.config import index, chunks, chunk_metadata, processed_docs
+from app.config import index, chunks, chunk_metadata, processed_docs, startup_status
 
 app = FastAPI(title="Fortinet Chatbot")
 
@@ -31,19 +33,9 @@ def ensure_directories():
     UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
     print(f"Répertoires vérifiés: {DATA_DIR}, {UPLOADS_DIR}")
 
-@app.on_event("startup")
-async def startup_event():
-    global index
-    
-    ensure_directories()
+warmup_task = None
 
-    loaded_index = load_index_and_data()
-    if loaded_index is not None:
-        index = loaded_index
-    
-    load_session_history()
-    clean_expired_sessions()
-    
+def print_startup_diagnostics():
     import sys
     config_module = sys.modules.get('app.config')
     
@@ -63,13 +55,51 @@ async def startup_event():
     print(f"Métadonnées: {len(chunk_metadata)}")
     print(f"Documents traités: {len(processed_docs)}")
 
+async def warm_up():
+    global index
+    
+    start_time = time.time()
+    startup_status["state"] = "loading"
+    try:
+        loaded_index = await asyncio.to_thread(load_index_and_data)
+        if loaded_index is not None:
+            index = loaded_index
+        
+        await asyncio.to_thread(load_session_history)
+        clean_expired_sessions()
+        
+        startup_status["load_seconds"] = round(time.time() - start_time, 2)
+        startup_status["state"] = "ready"
+        startup_status["ready"] = True
+        print(f"Chargement terminé en {startup_status['load_seconds']}s, service prêt")
+        print_startup_diagnostics()
+    except Exception as e:
+        startup_status["state"] = "failed"
+        startup_status["error"] = str(e)
+        print(f"Erreur lors du chargement au démarrage: {str(e)}")
+
+@app.on_event("startup")
+async def startup_event():
+    global warmup_task
+    
+    ensure_directories()
+    warmup_task = asyncio.create_task(warm_up())
+    print("Serveur démarré, chargement de l'index en arrière-plan...")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     from app.doc_processing import save_index_and_data
     from app.session_manager import save_session_history
+    from app.extraction import shutdown_extraction_pool
+    from app.concurrency import shutdown_blocking_executor
     
+    shutdown_extraction_pool()
+    shutdown_blocking_executor()
+    if not startup_status["ready"]:
+        print("Chargement non terminé, pas de sauvegarde à l'arrêt")
+        return
     print("Sauvegarde des données avant arrêt...")
-    save_index_and_data()
+    await asyncio.to_thread(save_index_and_data)
     save_session_history()
     print("Sauvegarde terminée.")
 
@@ -0,0 +1,232 @@
+import sys
+from collections.abc import Mapping
+import numpy as np
+
+NO_PAGE = -1
+
+COLUMNS = {
+    "source_ids": np.int32,
+    "types": np.uint8,
+    "pages": np.int32,
+    "start_chars": np.int64,
+    "lengths": np.int32,
+    "tokens": np.int32,
+    "deleted": np.bool_
+}
+
+class ChunkMetadata(Mapping):
+    def __init__(self, store, pos):
+        self.store = store
+        self.pos = pos
+
+    def __getitem__(self, key):
+        return self.store.get_field(self.pos, key)
+
+    def __setitem__(self, key, value):
+        self.store.set_field(self.pos, key, value)
+
+    def __iter__(self):
+        for key in ("source", "page", "type", "start_char", "length", "tokens", "deleted"):
+            if key != "page" or self.store.pages[self.pos] != NO_PAGE:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class ChunkMetadataStore:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.sources = []
+        self.source_index = {}
+        self.type_names = []
+        self.type_index = {}
+        self.size = 0
+        for name, dtype in COLUMNS.items():
+            setattr(self, "_" + name, np.zeros(0, dtype=dtype))
+
+    def _intern(self, table, lookup, value):
+        code = lookup.get(value)
+        if code is None:
+            code = len(table)
+            table.append(value)
+            lookup[value] = code
+        return code
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = len(self._source_ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in COLUMNS:
+            column = getattr(self, "_" + name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, "_" + name, grown)
+
+    def __getattr__(self, name):
+        if name in COLUMNS:
+            return getattr(self, "_" + name)[:self.size]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [ChunkMetadata(self, i) for i in range(*pos.indices(self.size))]
+        if pos < 0:
+            pos += self.size
+        if pos < 0 or pos >= self.size:
+            raise IndexError("metadata index out of range")
+        return ChunkMetadata(self, pos)
+
+    def __iter__(self):
+        for pos in range(self.size):
+            yield ChunkMetadata(self, pos)
+
+    def get_field(self, pos, key):
+        if key == "source":
+            return self.sources[self._source_ids[pos]]
+        if key == "type":
+            return self.type_names[self._types[pos]]
+        if key == "page":
+            page = int(self._pages[pos])
+            if page == NO_PAGE:
+                raise KeyError(key)
+            return page
+        if key == "start_char":
+            return int(self._start_chars[pos])
+        if key == "length":
+            return int(self._lengths[pos])
+        if key == "tokens":
+            return int(self._tokens[pos])
+        if key == "deleted":
+            return bool(self._deleted[pos])
+        raise KeyError(key)
+
+    def set_field(self, pos, key, value):
+        if key == "source":
+            self._source_ids[pos] = self._intern(self.sources, self.source_index, value)
+        elif key == "type":
+            self._types[pos] = self._intern(self.type_names, self.type_index, value)
+        elif key == "page":
+            self._pages[pos] = NO_PAGE if value is None else value
+        elif key == "start_char":
+            self._start_chars[pos] = value
+        elif key == "length":
+            self._lengths[pos] = value
+        elif key == "tokens":
+            self._tokens[pos] = value
+        elif key == "deleted":
+            self._deleted[pos] = bool(value)
+        else:
+            raise KeyError(key)
+
+    def append(self, meta):
+        self._reserve(1)
+        pos = self.size
+        self.size += 1
+        self._source_ids[pos] = self._intern(self.sources, self.source_index, meta["source"])
+        self._types[pos] = self._intern(self.type_names, self.type_index, meta.get("type", "txt"))
+        self._pages[pos] = meta.get("page", NO_PAGE)
+        self._start_chars[pos] = meta.get("start_char", 0)
+        self._lengths[pos] = meta.get("length", 0)
+        self._tokens[pos] = meta.get("tokens", 0)
+        self._deleted[pos] = bool(meta.get("deleted", False))
+
+    def extend(self, metas):
+        if isinstance(metas, ChunkMetadataStore):
+            self.extend_columns(metas.columns())
+            return
+        for meta in metas:
+            self.append(meta)
+
+    def columns(self, start=0, end=None):
+        end = self.size if end is None else end
+        source_codes, local_sources = np.unique(self._source_ids[start:end], return_inverse=True)
+        type_codes, local_types = np.unique(self._types[start:end], return_inverse=True)
+        return {
+            "sources": np.array([self.sources[c] for c in source_codes], dtype=str),
+            "type_names": np.array([self.type_names[c] for c in type_codes], dtype=str),
+            "source_ids": local_sources.astype(np.int32),
+            "types": local_types.astype(np.uint8),
+            "pages": self._pages[start:end].copy(),
+            "start_chars": self._start_chars[start:end].copy(),
+            "lengths": self._lengths[start:end].copy(),
+            "tokens": self._tokens[start:end].copy(),
+            "deleted": self._deleted[start:end].copy()
+        }
+
+    def extend_columns(self, columns):
+        count = len(columns["source_ids"])
+        if count == 0:
+            return
+        source_map = np.array(
+            [self._intern(self.sources, self.source_index, str(s)) for s in columns["sources"]],
+            dtype=np.int32
+        )
+        type_map = np.array(
+            [self._intern(self.type_names, self.type_index, str(t)) for t in columns["type_names"]],
+            dtype=np.uint8
+        )
+        self._reserve(count)
+        start, end = self.size, self.size + count
+        self._source_ids[start:end] = source_map[columns["source_ids"]]
+        self._types[start:end] = type_map[columns["types"]]
+        for name in ("pages", "start_chars", "lengths", "tokens", "deleted"):
+            getattr(self, "_" + name)[start:end] = columns[name] if name in columns else 0
+        self.size = end
+
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        subset = ChunkMetadataStore()
+        subset.sources = list(self.sources)
+        subset.source_index = dict(self.source_index)
+        subset.type_names = list(self.type_names)
+        subset.type_index = dict(self.type_index)
+        subset.size = len(positions)
+        for name in COLUMNS:
+            setattr(subset, "_" + name, getattr(self, "_" + name)[positions])
+        return subset
+
+    def replace(self, other):
+        self.sources = other.sources
+        self.source_index = other.source_index
+        self.type_names = other.type_names
+        self.type_index = other.type_index
+        for name in COLUMNS:
+            setattr(self, "_" + name, getattr(other, "_" + name))
+        self.size = other.size
+
+    def memory_usage(self):
+        columns = sum(getattr(self, "_" + name).nbytes for name in COLUMNS)
+        strings = sum(sys.getsizeof(s) for s in self.sources + self.type_names)
+        return columns + strings
+
+def column_rows(seg_meta):
+    if isinstance(seg_meta, dict):
+        return len(seg_meta["source_ids"])
+    return len(seg_meta)
+
+def save_columns(path, columns):
+    packed = dict(columns)
+    packed["deleted"] = np.packbits(columns["deleted"])
+    packed["rows"] = np.array([len(columns["source_ids"])], dtype=np.int64)
+    with open(path, 'wb') as f:
+        np.savez(f, **packed)
+
+def load_columns(path):
+    with np.load(path, allow_pickle=False) as data:
+        columns = {name: data[name] for name in data.files}
+    rows = int(columns.pop("rows")[0])
+    columns["deleted"] = np.unpackbits(columns["deleted"], count=rows).astype(np.bool_)
+    return columns
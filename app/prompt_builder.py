@@ -0,0 +1,84 @@
+from functools import lru_cache
+from mistralai.models.chat_completion import ChatMessage
+
+from app.config import PROMPT_TOKEN_BUDGET, MAX_TOKENS_HISTORY, MESSAGE_TOKEN_OVERHEAD
+from app.tokens import count_tokens, truncate_to_tokens
+
+SUMMARY_HEADER = "\n\nSummary of the earlier conversation:\n"
+SUMMARY_HEADER_TOKENS = count_tokens(SUMMARY_HEADER)
+
+@lru_cache(maxsize=8)
+def template_tokens(system_template):
+    return count_tokens(system_template.format(context=""))
+
+def message_tokens(message):
+    return message.get("tokens") or count_tokens(message["content"])
+
+def excerpt_header(number, source_info):
+    return f"Extrait {number} (source: {source_info}):\n"
+
+def select_history(history, budget):
+    selected = []
+    used = 0
+    for message in reversed(history):
+        cost = message_tokens(message) + MESSAGE_TOKEN_OVERHEAD
+        if used + cost > budget:
+            break
+        selected.append(message)
+        used += cost
+    selected.reverse()
+    while selected and selected[0]["role"] != "user":
+        used -= message_tokens(selected.pop(0)) + MESSAGE_TOKEN_OVERHEAD
+    return selected, used
+
+def pack_excerpts(excerpts, budget):
+    packed = []
+    used = 0
+    for excerpt in excerpts:
+        header_tokens = count_tokens(excerpt_header(len(packed) + 1, excerpt["source_info"])) + 1
+        cost = header_tokens + excerpt["tokens"]
+        if used + cost <= budget:
+            packed.append(excerpt)
+            used += cost
+        elif not packed and budget - used > header_tokens:
+            text = truncate_to_tokens(excerpt["text"], budget - used - header_tokens)
+            packed.append({**excerpt, "text": text, "tokens": count_tokens(text)})
+            used += header_tokens + packed[-1]["tokens"]
+    return packed, used
+
+def build_chat_messages(system_template, excerpts, history, question, summary="", budget=PROMPT_TOKEN_BUDGET):
+    fixed = template_tokens(system_template) + count_tokens(question) + 2 * MESSAGE_TOKEN_OVERHEAD
+    available = max(budget - fixed, 0)
+    history_budget = min(MAX_TOKENS_HISTORY, available)
+    
+    summary_block = ""
+    summary_tokens = 0
+    if summary:
+        summary = truncate_to_tokens(summary, history_budget - SUMMARY_HEADER_TOKENS)
+        if summary:
+            summary_block = SUMMARY_HEADER + summary
+            summary_tokens = count_tokens(summary_block)
+    
+    history_messages, history_tokens = select_history(history, history_budget - summary_tokens)
+    history_tokens += summary_tokens
+    packed, context_tokens = pack_excerpts(excerpts, available - history_tokens)
+    
+    context = "\n\n".join(
+        excerpt_header(i + 1, excerpt["source_info"]) + excerpt["text"]
+        for i, excerpt in enumerate(packed)
+    )
+    messages = [ChatMessage(role="system", content=system_template.format(context=context) + summary_block)]
+    for message in history_messages:
+        messages.append(ChatMessage(role=message["role"], content=message["content"]))
+    messages.append(ChatMessage(role="user", content=question))
+    
+    usage = {
+        "prompt_tokens": fixed + history_tokens + context_tokens,
+        "context_tokens": context_tokens,
+        "history_tokens": history_tokens,
+        "excerpts": len(packed),
+        "excerpts_dropped": len(excerpts) - len(packed),
+        "history_messages": len(history_messages),
+        "history_dropped": len(history) - len(history_messages)
+    }
+    return messages, packed, usage
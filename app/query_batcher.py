@@ -0,0 +1,91 @@
+import asyncio
+import numpy as np
+
+from app.config import (
+    client, EMBEDDING_MODEL, QUERY_BATCH_MAX_ITEMS, QUERY_BATCH_MAX_WAIT_MS
+)
+from app.concurrency import run_blocking
+from app.retrieval import search_index
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_items=QUERY_BATCH_MAX_ITEMS, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = []
+        self.timer = None
+        self.running = set()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_items:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        task = asyncio.ensure_future(self._run(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await run_blocking(self.batch_fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "largest_batch": self.largest_batch,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+        }
+
+def embed_questions(questions):
+    unique = list(dict.fromkeys(questions))
+    resp = client.embeddings(model=EMBEDDING_MODEL, input=unique)
+    by_text = {text: item.embedding for text, item in zip(unique, resp.data)}
+    return [by_text[q] for q in questions]
+
+def search_queries(requests):
+    results = [None] * len(requests)
+    groups = {}
+    for i, (current_index, query_row, k, filters) in enumerate(requests):
+        groups.setdefault((id(current_index), k, filters), []).append(i)
+    for (_, k, filters), positions in groups.items():
+        current_index = requests[positions[0]][0]
+        queries = np.vstack([requests[i][1] for i in positions]).astype('float32')
+        for i, hits in zip(positions, search_index(current_index, queries, k, filters=filters)):
+            results[i] = hits
+    return results
+
+embedding_batcher = MicroBatcher(embed_questions)
+search_batcher = MicroBatcher(search_queries)
+
+def batching_stats():
+    return {
+        "embeddings": embedding_batcher.stats(),
+        "search": search_batcher.stats()
+    }
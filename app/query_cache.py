@@ -0,0 +1,137 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from app.config import (
+    QUESTION_CACHE_MAX_ENTRIES, QUESTION_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY
+)
+
+def normalize_question(question):
+    return re.sub(r'\s+', ' ', question).strip().lower()
+
+class LRUCache:
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+class SemanticAnswerCache:
+    def __init__(self, max_entries, ttl_seconds, similarity):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.index_version = None
+        self.entries = []
+
+    def _check_version(self, index_version):
+        if self.index_version is None or index_version > self.index_version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries = []
+            self.index_version = index_version
+        return index_version == self.index_version
+
+    def _expire(self):
+        now = time.monotonic()
+        self.entries = [e for e in self.entries if now - e["created"] <= self.ttl_seconds]
+
+    def get(self, embedding, chunk_ids, index_version):
+        with self.lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            self._expire()
+            if self.entries:
+                embedding = np.asarray(embedding, dtype=np.float32).ravel()
+                matrix = np.stack([e["embedding"] for e in self.entries])
+                scores = matrix @ embedding
+                for pos in np.argsort(-scores):
+                    if scores[pos] < self.similarity:
+                        break
+                    entry = self.entries[pos]
+                    if entry["chunk_ids"] == tuple(chunk_ids):
+                        self.hits += 1
+                        return entry
+            self.misses += 1
+            return None
+
+    def put(self, embedding, chunk_ids, answer, sources, index_version):
+        with self.lock:
+            if not self._check_version(index_version):
+                return
+            self.entries.append({
+                "embedding": np.asarray(embedding, dtype=np.float32).ravel().copy(),
+                "chunk_ids": tuple(chunk_ids),
+                "answer": answer,
+                "sources": list(sources),
+                "created": time.monotonic()
+            })
+            if len(self.entries) > self.max_entries:
+                self.entries = self.entries[-self.max_entries:]
+
+    def clear(self):
+        with self.lock:
+            self.entries = []
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+question_embedding_cache = LRUCache(QUESTION_CACHE_MAX_ENTRIES, QUESTION_CACHE_TTL_SECONDS)
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
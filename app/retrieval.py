@@ -0,0 +1,230 @@
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from app.config import (
+    chunks, chunk_ids, chunk_metadata, deleted_chunk_ids, processed_docs,
+    INDEX_METRIC, HNSW_EF_SEARCH, IVF_NPROBE,
+    TOP_K, RRF_K, MMR_LAMBDA, MMR_MAX_PER_SOURCE, FILTER_CACHE_SIZE, FILTER_MAX_SEARCH_BOOST, LEXICAL_FAST_PATH, LEXICAL_FAST_PATH_MIN_TERMS
+)
+from app.doc_processing import get_chunk_position, get_file_type
+from app.concurrency import index_lock
+from app.lexical_index import lexical_index, tokenize, contains_phrase
+
+_selector_cache = {"version": None, "selectors": None}
+_filter_cache = {"version": None, "entries": OrderedDict()}
+_filter_lock = threading.Lock()
+
+PRODUCT_PATTERN = re.compile(r'(forti[a-z]+)[\s_\-]*v?(\d+(?:\.\d+)?)?', re.IGNORECASE)
+
+def get_tombstone_selector():
+    import faiss
+    from app import config
+    if not deleted_chunk_ids:
+        return None
+    if _selector_cache["version"] != config.index_version:
+        dead = faiss.IDSelectorBatch(np.fromiter(deleted_chunk_ids, dtype=np.int64, count=len(deleted_chunk_ids)))
+        alive = faiss.IDSelectorNot(dead)
+        _selector_cache["selectors"] = (dead, alive)
+        _selector_cache["version"] = config.index_version
+    return _selector_cache["selectors"][1]
+
+def normalize_filter_value(value):
+    return re.sub(r'[\s_]+', '-', value.strip().lower())
+
+def source_products(source):
+    products = set()
+    for name, version in PRODUCT_PATTERN.findall(source):
+        name = name.lower()
+        products.add(name)
+        if version:
+            products.add(f"{name}-{version}")
+    return products
+
+def parse_filters(sources=None, types=None, products=None):
+    def split(value):
+        return sorted({v.strip() for v in value.split(',') if v.strip()}) if value else []
+    filters = (
+        tuple(split(sources)),
+        tuple(sorted({t.lower() for t in split(types)})),
+        tuple(sorted({normalize_filter_value(p) for p in split(products)}))
+    )
+    return filters if any(filters) else None
+
+def source_matches(filters, name):
+    sources, types, products = filters
+    if sources and name not in sources:
+        return False
+    if products and not source_products(name) & set(products):
+        return False
+    return not types or get_file_type(name) in types
+
+def build_filter_ids(filters):
+    sources, types, products = filters
+    names = [
+        name for name in chunk_metadata.sources
+        if (not sources or name in sources) and (not products or source_products(name) & set(products))
+    ]
+    codes = [chunk_metadata.source_index[name] for name in names]
+    mask = ~chunk_metadata.deleted & np.isin(chunk_metadata.source_ids, codes)
+    if types:
+        type_codes = [chunk_metadata.type_index[t] for t in types if t in chunk_metadata.type_index]
+        mask &= np.isin(chunk_metadata.types, type_codes)
+    ids = np.asarray(chunk_ids, dtype=np.int64)[mask]
+    
+    alias_ids = []
+    for doc in processed_docs:
+        if not doc.get("aliases") or not source_matches(filters, doc["filename"]):
+            continue
+        alias_ids.extend(cid for cid, _ in doc["aliases"] if cid not in deleted_chunk_ids)
+    if alias_ids:
+        ids = np.union1d(ids, np.asarray(alias_ids, dtype=np.int64))
+    return ids
+
+def get_filter_selector(filters):
+    import faiss
+    from app import config
+    with _filter_lock:
+        cache = _filter_cache["entries"]
+        if _filter_cache["version"] != config.index_version:
+            cache.clear()
+            _filter_cache["version"] = config.index_version
+        entry = cache.get(filters)
+        if entry is None:
+            ids = build_filter_ids(filters)
+            entry = (ids, faiss.IDSelectorBatch(ids) if len(ids) else None)
+            cache[filters] = entry
+            while len(cache) > FILTER_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(filters)
+    return entry
+
+def build_search_params(current_index, selector=None, ef_search=None, nprobe=None):
+    import faiss
+    base = faiss.downcast_index(current_index.index) if isinstance(current_index, faiss.IndexIDMap2) else current_index
+    if isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or HNSW_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or IVF_NPROBE
+    elif selector is None:
+        return None
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def distance_to_score(distance):
+    if INDEX_METRIC == "ip":
+        return float(distance)
+    return 1.0 - float(distance) / 2.0
+
+def search_index(current_index, query_np, k, ef_search=None, nprobe=None, filters=None):
+    if filters is None:
+        selector = get_tombstone_selector()
+    else:
+        allowed_ids, selector = get_filter_selector(filters)
+        if selector is None:
+            return [[] for _ in range(len(query_np))]
+        boost = min(current_index.ntotal / len(allowed_ids), FILTER_MAX_SEARCH_BOOST)
+        ef_search = int((ef_search or HNSW_EF_SEARCH) * boost)
+        nprobe = int((nprobe or IVF_NPROBE) * boost)
+    params = build_search_params(current_index, selector, ef_search, nprobe)
+    with index_lock.read():
+        distances, ids = current_index.search(query_np, k, params=params)
+    results = []
+    for row_distances, row_ids in zip(distances, ids):
+        hits = []
+        for distance, chunk_id in zip(row_distances, row_ids):
+            if chunk_id < 0 or chunk_id in deleted_chunk_ids:
+                continue
+            hits.append((int(chunk_id), distance_to_score(distance)))
+        results.append(hits)
+    return results
+
+def lexical_search(question, k, filters=None):
+    allowed = get_filter_selector(filters)[0] if filters is not None else None
+    return lexical_index.search(tokenize(question), k, excluded=deleted_chunk_ids, allowed=allowed)
+
+def lexical_search_many(questions, k, filters=None):
+    return [lexical_search(question, k, filters) for question in questions]
+
+def reciprocal_rank_fusion(result_lists, k=RRF_K):
+    scores = {}
+    for hits in result_lists:
+        for rank, (chunk_id, _) in enumerate(hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: -x[1])
+
+def exact_phrases(question):
+    quoted = re.findall(r'`([^`]+)`|"([^"]+)"|«([^»]+)»', question)
+    phrases = [next(p for p in groups if p) for groups in quoted] or [question]
+    return [tokenize(p) for p in phrases]
+
+def chunk_text(chunk_id):
+    pos = get_chunk_position(chunk_id)
+    return chunks[pos] if pos is not None else ""
+
+def lexical_fast_path(question, hits):
+    if not LEXICAL_FAST_PATH or not hits:
+        return None
+    phrases = exact_phrases(question)
+    if any(len(tokens) < LEXICAL_FAST_PATH_MIN_TERMS for tokens in phrases):
+        return None
+    top_score = hits[0][1]
+    with index_lock.read():
+        texts = [chunk_text(chunk_id) for chunk_id, _ in hits]
+    exact = [
+        (chunk_id, score + top_score) for (chunk_id, score), text in zip(hits, texts)
+        if all(contains_phrase(text, tokens) for tokens in phrases)
+    ]
+    if not exact:
+        return None
+    exact_ids = {chunk_id for chunk_id, _ in exact}
+    return exact + [hit for hit in hits if hit[0] not in exact_ids]
+
+def lexical_candidates(question, k, filters=None):
+    hits = lexical_search(question, k, filters)
+    return hits, lexical_fast_path(question, hits)
+
+def mmr_select(relevance, vectors, groups, k, lambda_=MMR_LAMBDA, max_per_group=MMR_MAX_PER_SOURCE):
+    n = len(relevance)
+    selected = []
+    if n == 0:
+        return selected
+    max_similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    group_counts = np.zeros(int(groups.max()) + 1, dtype=np.int32)
+    while len(selected) < min(k, n):
+        allowed = available & (group_counts[groups] < max_per_group)
+        if not allowed.any():
+            allowed = available
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        pick = int(np.argmax(np.where(allowed, scores, -np.inf)))
+        selected.append(pick)
+        available[pick] = False
+        group_counts[groups[pick]] += 1
+        np.maximum(max_similarity, vectors @ vectors[pick], out=max_similarity)
+    return selected
+
+def select_context(current_index, hits, k=TOP_K):
+    with index_lock.read():
+        live = []
+        for chunk_id, score in hits:
+            pos = get_chunk_position(chunk_id)
+            if pos is not None:
+                live.append((chunk_id, score, pos))
+        if not live:
+            return []
+        ids = np.fromiter((chunk_id for chunk_id, _, _ in live), dtype=np.int64, count=len(live))
+        positions = np.fromiter((pos for _, _, pos in live), dtype=np.int64, count=len(live))
+        vectors = current_index.reconstruct_batch(ids)
+        groups = chunk_metadata.source_ids[positions]
+    scores = np.fromiter((score for _, score, _ in live), dtype=np.float32, count=len(live))
+    span = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+    return [int(ids[i]) for i in mmr_select(relevance, vectors, groups, k)]
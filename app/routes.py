@@ -1,157 +1,147 @@
 from fastapi import (
     APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
 )
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
 import os
+import json
 import uuid
+import time
 from datetime import datetime
 import numpy as np
-import faiss
-import PyPDF2
 
 import app.config as config
 
 from app.config import (
-    processing_status, processed_docs, chunks, chunk_metadata,
-    UPLOADS_DIR, TOP_K, client, session_history
+    processing_status, startup_status, processed_docs, chunks, chunk_metadata, chunk_ids, deleted_chunk_ids,
+    UPLOADS_DIR, COMPACTION_THRESHOLD, EMBEDDING_MODEL, RETRIEVAL_MODE, RETRIEVAL_CANDIDATES,
+    ASK_BATCH_MAX_QUESTIONS, ASK_BATCH_CONCURRENCY, EMBEDDING_CONCURRENCY, client, session_history
 )
 
 from app.doc_processing import (
     process_files_in_background, debug_chunks_info, process_existing_chunks,
-    load_index_and_data, save_index_and_data, process_web_content
+    load_index_and_data, save_index_and_data, process_web_content,
+    remove_document, get_chunk_position, get_dead_ratio, get_dedup_ratio, compact_index
 )
 from app.session_manager import (
-    create_or_update_session, add_message_to_history, get_session_messages,
-    get_chat_messages_with_history, clean_expired_sessions, clear_session,
-    load_session_history, save_session_history
+    create_or_update_session, add_turn_to_history, get_session_messages,
+    get_session_turns, get_session_summary, needs_summary, summarize_session,
+    clean_expired_sessions, clear_session,
+    touch_session
+)
+from app.lexical_index import lexical_index
+from app.retrieval import (
+    search_index, lexical_search_many, lexical_candidates, reciprocal_rank_fusion, select_context,
+    parse_filters, get_filter_selector, source_matches
+)
+from app.embedding_engine import pack_batches
+from app.prompt_builder import build_chat_messages
+from app.embedding_cache import embedding_cache
+from app.concurrency import run_blocking, index_lock, llm_admission, AdmissionRejected
+from app.query_batcher import embedding_batcher, search_batcher, batching_stats, embed_questions
+from app.query_cache import question_embedding_cache, answer_cache, normalize_question
+from app.upload_handler import (
+    is_supported_file, is_archive, save_upload, expand_archive_upload
 )
-from app.web_scraper import WebScraper
 
 router = APIRouter()
 
+def require_ready():
+    if startup_status["state"] == "failed":
+        raise HTTPException(
+            status_code=503,
+            detail=f"Le chargement des données a échoué, service indisponible: {startup_status['error']}"
+        )
+    if not startup_status["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail="Le service démarre (chargement de l'index en cours), veuillez réessayer dans quelques instants.",
+            headers={"Retry-After": "5"}
+        )
+
+def cited_sources(chunk_id, meta, filters=None):
+    owners = [(meta["source"], meta.get("page") if meta["type"] == "pdf" else None)]
+    owners += processed_docs.aliases_for(chunk_id)
+    if filters is not None:
+        owners = [owner for owner in owners if source_matches(filters, owner[0])] or owners[:1]
+    return [f"{source} (page {page})" if page else source for source, page in owners]
+
+@router.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def health_ready():
+    if not startup_status["ready"]:
+        return JSONResponse(status_code=503, content={"status": startup_status["state"], "error": startup_status["error"]})
+    return {
+        "status": "ready",
+        "load_seconds": startup_status["load_seconds"],
+        "index_vectors": config.index.ntotal if config.index else 0
+    }
+
 @router.get("/status")
 async def get_status():
     docs_info = {
         "total_documents": len(processed_docs),
-        "document_list": [doc["filename"] for doc in processed_docs],
+        "document_list": processed_docs.filenames(),
         "total_chunks": len(chunks),
-        "index_vectors": config.index.ntotal if config.index else 0
+        "index_vectors": config.index.ntotal if config.index else 0,
+        "deleted_chunks": len(deleted_chunk_ids),
+        "aliased_chunks": sum(len(doc.get("aliases", [])) for doc in processed_docs),
+        "dead_ratio": round(get_dead_ratio(), 4),
+        "metadata_bytes": chunk_metadata.memory_usage(),
+        "embedding_cache": embedding_cache.stats(),
+        "question_cache": question_embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "llm_admission": llm_admission.stats(),
+        "query_batching": batching_stats(),
+        "retrieval_mode": RETRIEVAL_MODE,
+        "lexical_terms": len(lexical_index.postings),
+        "startup": startup_status
     }
     return {**processing_status, **docs_info}
 
 @router.post("/upload")
 async def upload_pdfs(files: List[UploadFile] = File(...), background_tasks: BackgroundTasks = None):
+    require_ready()
     if processing_status["is_processing"]:
         raise HTTPException(status_code=400, detail="Un traitement de documents est déjà en cours")
     
+    for file in files:
+        if not (is_supported_file(file.filename) or is_archive(file.filename)):
+            raise HTTPException(
+                status_code=400,
+                detail=f"{file.filename} n'est pas un fichier supporté (PDF, TXT ou archive ZIP/TAR)"
+            )
+    
     try:
-        files_content = []
         filenames = []
         file_paths = []
+        file_hashes = []
         
         for file in files:
-            if file.filename.endswith('.pdf') or file.filename.endswith('.txt'):
-                content = await file.read()
-                os.makedirs(UPLOADS_DIR, exist_ok=True)
-                file_path = UPLOADS_DIR / file.filename
-                with open(file_path, "wb") as f:
-                    f.write(content)
-                
-                files_content.append(content)
-                filenames.append(file.filename)
-                file_paths.append(file_path)
+            if is_archive(file.filename):
+                saved = await expand_archive_upload(file)
             else:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"{file.filename} n'est pas un fichier supporté (PDF ou TXT)"
-                )
+                saved = [await save_upload(file)]
+            for filename, file_path, file_hash in saved:
+                filenames.append(filename)
+                file_paths.append(file_path)
+                file_hashes.append(file_hash)
+            await file.close()
         
-        background_tasks.add_task(process_files_in_background, files_content, filenames, file_paths)
+        background_tasks.add_task(process_files_in_background, filenames, file_paths, file_hashes)
         return {
             "status": "processing",
-            "message": f"Traitement de {len(files)} fichiers en cours. Consultez /status pour suivre l'avancement."
+            "message": f"Traitement de {len(filenames)} fichiers en cours. Consultez /status pour suivre l'avancement."
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/ask")
-async def ask_question(question: str = Form(...), session_id: Optional[str] = Form(None)):
-    clean_expired_sessions()
-    
-    import sys
-    config_module = sys.modules.get('app.config')
-    current_index = config_module.index if config_module else None
-    
-    print(f"Debug ask_question: index={current_index is not None}, chunks={len(chunks)}")
-    
-    if current_index is None or current_index.ntotal == 0 or len(chunks) == 0:
-        raise HTTPException(status_code=400, detail="Aucun document n'a été chargé. Veuillez d'abord uploader des PDFs.")
-    
-    if not session_id:
-        session_id = str(uuid.uuid4())
-    create_or_update_session(session_id, question)
-    
-    try:
-        question_embedding_resp = client.embeddings(
-            model="mistral-embed",
-            input=[question]
-        )
-        question_embedding = question_embedding_resp.data[0].embedding
-        question_np = np.array([question_embedding]).astype('float32')
-        faiss.normalize_L2(question_np)
-        
-        extended_k = TOP_K * 4
-        distances, indices_ = current_index.search(question_np, extended_k)
-                
-        seen_sources = set()
-        diverse_context_parts = []
-        diverse_sources = []
-        
-        for i, idx_ in enumerate(indices_[0]):
-            if len(diverse_context_parts) >= TOP_K:
-                break
-            if idx_ >= len(chunks) or idx_ >= len(chunk_metadata):
-                continue
-            chunk_text = chunks[idx_]
-            meta = chunk_metadata[idx_]
-            src = meta["source"]
-            if src not in seen_sources or len(diverse_context_parts) < TOP_K / 2:
-                seen_sources.add(src)
-                if meta["type"] == "pdf":
-                    source_info = f"{meta['source']} (page {meta['page']})"
-                else:
-                    source_info = meta["source"]
-                if source_info not in diverse_sources:
-                    diverse_sources.append(source_info)
-                
-                diverse_context_parts.append(
-                    f"Extrait {len(diverse_context_parts)+1} (source: {source_info}):\n{chunk_text}"
-                )
-        
-        if len(diverse_context_parts) < TOP_K:
-            for i, idx_ in enumerate(indices_[0]):
-                if len(diverse_context_parts) >= TOP_K:
-                    break
-                if idx_ >= len(chunks) or idx_ >= len(chunk_metadata):
-                    continue
-                chunk_text = chunks[idx_]
-                meta = chunk_metadata[idx_]
-                already_included = any(chunk_text in part for part in diverse_context_parts)
-                if not already_included:
-                    if meta["type"] == "pdf":
-                        source_info = f"{meta['source']} (page {meta['page']})"
-                    else:
-                        source_info = meta["source"]
-                    if source_info not in diverse_sources:
-                        diverse_sources.append(source_info)
-                    
-                    diverse_context_parts.append(
-                        f"Extrait {len(diverse_context_parts)+1} (source: {source_info}):\n{chunk_text}"
-                    )
-        
-        context = "\n\n".join(diverse_context_parts)
-        
-        system_prompt = f"""
+SYSTEM_PROMPT_TEMPLATE = """
         You are a highly knowledgeable technical assistant specializing in Fortinet products – particularly FortiManager and FortiAnalyzer. You are designed to support system engineers by answering technical questions solely based on the provided context extracted from Fortinet documentation. 
 
         Instructions:
@@ -169,65 +159,442 @@ async def ask_question(question: str = Form(...), session_id: Optional[str] = Fo
         {context}
         """
 
-        messages = get_chat_messages_with_history(session_id, system_prompt, question)
-        chat_response = client.chat(
-            model="mistral-large-latest",
-            messages=messages,
-            temperature=0.1,
-            max_tokens=1024
+async def embed_question(question):
+    import faiss
+    cache_key = (EMBEDDING_MODEL, normalize_question(question))
+    question_embedding = question_embedding_cache.get(cache_key)
+    if question_embedding is None:
+        question_embedding = await embedding_batcher.submit(question)
+        question_embedding_cache.put(cache_key, question_embedding)
+    question_np = np.array([question_embedding]).astype('float32')
+    faiss.normalize_L2(question_np)
+    return question_np
+
+async def retrieve_hits(question, current_index, k, filters=None):
+    lexical_hits = None
+    if RETRIEVAL_MODE != "vector":
+        lexical_hits, exact_hits = await run_blocking(lexical_candidates, question, k, filters)
+        if exact_hits:
+            print("Correspondance lexicale exacte, recherche vectorielle ignorée")
+            return exact_hits, None
+        if RETRIEVAL_MODE == "lexical":
+            return lexical_hits, None
+    
+    question_np = await embed_question(question)
+    hits = await search_batcher.submit((current_index, question_np, k, filters))
+    if lexical_hits is not None:
+        hits = reciprocal_rank_fusion([hits, lexical_hits])[:k]
+    return hits, question_np
+
+async def require_index(filters=None):
+    import sys
+    config_module = sys.modules.get('app.config')
+    current_index = config_module.index if config_module else None
+    
+    print(f"Debug ask_question: index={current_index is not None}, chunks={len(chunks)}")
+    
+    if current_index is None or current_index.ntotal == 0 or len(chunks) == 0:
+        raise HTTPException(status_code=400, detail="Aucun document n'a été chargé. Veuillez d'abord uploader des PDFs.")
+    
+    if filters is not None and not len((await run_blocking(get_filter_selector, filters))[0]):
+        raise HTTPException(status_code=400, detail="Aucun document indexé ne correspond aux filtres demandés.")
+    return current_index
+
+def build_context(current_index, hits, history, question, summary="", filters=None):
+    excerpts = []
+    selected = select_context(current_index, hits)
+    with index_lock.read():
+        for chunk_id in selected:
+            pos = get_chunk_position(chunk_id)
+            if pos is None or chunk_id in deleted_chunk_ids:
+                continue
+            meta = chunk_metadata[pos]
+            cited = cited_sources(chunk_id, meta, filters)
+            excerpts.append({
+                "chunk_id": chunk_id,
+                "source_info": cited[0],
+                "cited": cited,
+                "text": chunks[pos],
+                "tokens": meta["tokens"]
+            })
+    
+    messages, packed, usage = build_chat_messages(SYSTEM_PROMPT_TEMPLATE, excerpts, history, question, summary)
+    if usage["excerpts_dropped"] or usage["history_dropped"]:
+        print(f"Budget du prompt: {usage['prompt_tokens']} tokens, {usage['excerpts_dropped']} extraits et {usage['history_dropped']} messages d'historique écartés")
+    
+    diverse_sources = []
+    for excerpt in packed:
+        for source_info in excerpt["cited"]:
+            if source_info not in diverse_sources:
+                diverse_sources.append(source_info)
+    
+    return messages, diverse_sources, [excerpt["chunk_id"] for excerpt in packed]
+
+async def embed_question_batch(questions):
+    import faiss
+    embeddings = {}
+    missing = []
+    for question in dict.fromkeys(questions):
+        question_embedding = question_embedding_cache.get((EMBEDDING_MODEL, normalize_question(question)))
+        if question_embedding is None:
+            missing.append(question)
+        else:
+            embeddings[question] = question_embedding
+    
+    semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+    
+    async def run_batch(batch):
+        texts = [missing[i] for i in batch]
+        async with semaphore:
+            vectors = await run_blocking(embed_questions, texts)
+        for text, vector in zip(texts, vectors):
+            embeddings[text] = vector
+            question_embedding_cache.put((EMBEDDING_MODEL, normalize_question(text)), vector)
+    
+    await asyncio.gather(*(run_batch(batch) for batch in pack_batches(missing)))
+    print(f"Lot de {len(questions)} questions vectorisé ({len(missing)} embeddings demandés)")
+    questions_np = np.array([embeddings[q] for q in questions]).astype('float32')
+    faiss.normalize_L2(questions_np)
+    return questions_np
+
+async def retrieve_batch_hits(questions, current_index, k, filters=None):
+    lexical_hits = None
+    if RETRIEVAL_MODE != "vector":
+        lexical_hits = await run_blocking(lexical_search_many, questions, k, filters)
+        if RETRIEVAL_MODE == "lexical":
+            return lexical_hits, None
+    
+    questions_np = await embed_question_batch(questions)
+    hits = await run_blocking(search_index, current_index, questions_np, k, filters=filters)
+    if lexical_hits is not None:
+        hits = [reciprocal_rank_fusion([v, l])[:k] for v, l in zip(hits, lexical_hits)]
+    return hits, questions_np
+
+async def prepare_question(question, session_id, filters=None):
+    require_ready()
+    await run_blocking(clean_expired_sessions)
+    current_index = await require_index(filters)
+    
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    await run_blocking(create_or_update_session, session_id, question)
+    first_turn = not get_session_turns(session_id) and not get_session_summary(session_id)
+    
+    hits, question_np = await retrieve_hits(question, current_index, RETRIEVAL_CANDIDATES, filters)
+            
+    history = get_session_messages(session_id)
+    summary = get_session_summary(session_id)
+    messages, diverse_sources, context_chunk_ids = await run_blocking(
+        build_context, current_index, hits, history, question, summary, filters
+    )
+    
+    cached = None
+    if first_turn and question_np is not None:
+        cached = answer_cache.get(question_np[0], context_chunk_ids, config.index_version)
+        if cached is not None:
+            print("Réponse servie depuis le cache sémantique")
+    
+    return {
+        "session_id": session_id,
+        "first_turn": first_turn,
+        "question_np": question_np,
+        "context_chunk_ids": context_chunk_ids,
+        "index_version": config.index_version,
+        "sources": diverse_sources,
+        "messages": messages,
+        "cached": cached
+    }
+
+def build_sources_html(sources):
+    sources_html = ""
+    if sources:
+        sources_html = "<div class=\"sources-section\">"
+        sources_html += "<div class=\"sources-title\">Sources:</div>"
+        sources_html += "<ul class=\"sources-list\">"
+        for source in sources:
+            source_type = "TXT"
+            if source.lower().endswith('.pdf') or '(page' in source.lower():
+                source_type = "PDF"
+            elif source.lower().endswith('.html'):
+                source_type = "HTML"
+            sources_html += f"<li><span class=\"source-badge\">{source_type}</span> {source}</li>"
+        sources_html += "</ul></div>"
+    return sources_html
+
+def cache_answer(prepared, answer):
+    if prepared["first_turn"] and prepared["cached"] is None and prepared["question_np"] is not None:
+        answer_cache.put(
+            prepared["question_np"][0], prepared["context_chunk_ids"],
+            answer, prepared["sources"], prepared["index_version"]
         )
-        answer = chat_response.choices[0].message.content
-        
-        sources_html = ""
-        if diverse_sources:
-            sources_html = "<div class=\"sources-section\">"
-            sources_html += "<div class=\"sources-title\">Sources:</div>"
-            sources_html += "<ul class=\"sources-list\">"
-            for source in diverse_sources:
-                source_type = "TXT"
-                if source.lower().endswith('.pdf') or '(page' in source.lower():
-                    source_type = "PDF"
-                elif source.lower().endswith('.html'):
-                    source_type = "HTML"
-                sources_html += f"<li><span class=\"source-badge\">{source_type}</span> {source}</li>"
-            sources_html += "</ul></div>"
-        
-        full_answer = answer + sources_html
+
+def finish_answer(prepared, question, answer):
+    cache_answer(prepared, answer)
+    add_turn_to_history(
+        prepared["session_id"], question, answer,
+        prepared["sources"], prepared["context_chunk_ids"]
+    )
+
+_summary_tasks = {}
+
+async def summarize_in_background(session_id):
+    try:
+        async with llm_admission:
+            await run_blocking(summarize_session, session_id)
+    except AdmissionRejected:
+        print(f"Résumé de la session {session_id} reporté: modèle saturé")
+
+def schedule_history_summary(session_id):
+    if session_id in _summary_tasks or not needs_summary(session_id):
+        return
+    task = asyncio.ensure_future(summarize_in_background(session_id))
+    _summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(session_id, None))
+
+def admission_error(e):
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/ask")
+async def ask_question(
+    question: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    sources: Optional[str] = Form(None),
+    types: Optional[str] = Form(None),
+    products: Optional[str] = Form(None)
+):
+    try:
+        filters = parse_filters(sources, types, products)
+        prepared = await prepare_question(question, session_id, filters)
+        if prepared["cached"] is not None:
+            answer = prepared["cached"]["answer"]
+        else:
+            messages = prepared["messages"]
+            async with llm_admission:
+                chat_response = await run_blocking(
+                    client.chat,
+                    model="mistral-large-latest",
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=1024
+                )
+            answer = chat_response.choices[0].message.content
         
-        add_message_to_history(session_id, "user", question)
-        add_message_to_history(session_id, "assistant", full_answer)
+        await run_blocking(finish_answer, prepared, question, answer)
+        schedule_history_summary(prepared["session_id"])
         
         return {
             "answer": answer,
-            "sources": diverse_sources,
-            "session_id": session_id
+            "sources": prepared["sources"],
+            "session_id": prepared["session_id"],
+            "cached": prepared["cached"] is not None
         }
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ask/stream")
+async def ask_question_stream(
+    question: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    sources: Optional[str] = Form(None),
+    types: Optional[str] = Form(None),
+    products: Optional[str] = Form(None)
+):
+    try:
+        filters = parse_filters(sources, types, products)
+        prepared = await prepare_question(question, session_id, filters)
+        if prepared["cached"] is None:
+            await llm_admission.acquire()
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        holds_slot = prepared["cached"] is None
+        try:
+            yield sse_event("sources", {
+                "sources": prepared["sources"],
+                "session_id": prepared["session_id"]
+            })
+            if not holds_slot:
+                answer = prepared["cached"]["answer"]
+                yield sse_event("token", {"content": answer})
+            else:
+                messages = prepared["messages"]
+                stream = await run_blocking(
+                    client.chat_stream,
+                    model="mistral-large-latest",
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=1024
+                )
+                answer_parts = []
+                while True:
+                    chunk = await run_blocking(next, stream, None)
+                    if chunk is None:
+                        break
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        answer_parts.append(content)
+                        yield sse_event("token", {"content": content})
+                answer = "".join(answer_parts)
+                llm_admission.release()
+                holds_slot = False
+            
+            await run_blocking(finish_answer, prepared, question, answer)
+            schedule_history_summary(prepared["session_id"])
+            yield sse_event("done", {
+                "session_id": prepared["session_id"],
+                "cached": prepared["cached"] is not None
+            })
+        except Exception as e:
+            print(f"Erreur pendant le streaming de la réponse: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            if holds_slot:
+                llm_admission.release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BatchQuestions(BaseModel):
+    questions: List[str]
+    sources: Optional[str] = None
+    types: Optional[str] = None
+    products: Optional[str] = None
+    persist_sessions: bool = False
+
+@router.post("/ask/batch")
+async def ask_question_batch(request: BatchQuestions):
+    require_ready()
+    questions = request.questions
+    if not questions:
+        raise HTTPException(status_code=400, detail="La liste de questions est vide.")
+    if len(questions) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"Trop de questions dans le lot (maximum {ASK_BATCH_MAX_QUESTIONS}).")
+    
+    try:
+        filters = parse_filters(request.sources, request.types, request.products)
+        current_index = await require_index(filters)
+        hits, questions_np = await retrieve_batch_hits(questions, current_index, RETRIEVAL_CANDIDATES, filters)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    index_version = config.index_version
+    semaphore = asyncio.Semaphore(ASK_BATCH_CONCURRENCY)
+    
+    async def answer_one(i, question):
+        result = {"index": i, "question": question}
+        async with semaphore:
+            try:
+                messages, sources, context_chunk_ids = await run_blocking(build_context, current_index, hits[i], [], question, "", filters)
+                prepared = {
+                    "session_id": str(uuid.uuid4()) if request.persist_sessions else None,
+                    "first_turn": True,
+                    "question_np": questions_np[i:i + 1] if questions_np is not None else None,
+                    "context_chunk_ids": context_chunk_ids,
+                    "index_version": index_version,
+                    "sources": sources,
+                    "messages": messages,
+                    "cached": None
+                }
+                if prepared["question_np"] is not None:
+                    prepared["cached"] = answer_cache.get(prepared["question_np"][0], context_chunk_ids, index_version)
+                
+                if prepared["cached"] is not None:
+                    answer = prepared["cached"]["answer"]
+                else:
+                    async with llm_admission:
+                        chat_response = await run_blocking(
+                            client.chat,
+                            model="mistral-large-latest",
+                            messages=messages,
+                            temperature=0.1,
+                            max_tokens=1024
+                        )
+                    answer = chat_response.choices[0].message.content
+                
+                if request.persist_sessions:
+                    await run_blocking(create_or_update_session, prepared["session_id"], question)
+                    await run_blocking(finish_answer, prepared, question, answer)
+                else:
+                    cache_answer(prepared, answer)
+                
+                result.update({
+                    "answer": answer,
+                    "sources": sources,
+                    "cached": prepared["cached"] is not None,
+                    "session_id": prepared["session_id"]
+                })
+            except AdmissionRejected as e:
+                result["error"] = e.detail
+            except Exception as e:
+                result["error"] = str(e)
+        return result
+    
+    async def result_stream():
+        start_time = time.monotonic()
+        tasks = [asyncio.ensure_future(answer_one(i, q)) for i, q in enumerate(questions)]
+        errors = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                errors += "error" in result
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            elapsed = time.monotonic() - start_time
+            print(f"Lot de {len(questions)} questions traité en {elapsed:.1f}s ({errors} erreurs)")
+            yield json.dumps({
+                "done": True,
+                "total": len(questions),
+                "errors": errors,
+                "elapsed_seconds": round(elapsed, 2)
+            }) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
 
 @router.get("/diagnosis/{filename}")
 async def diagnose_document(filename: str):
-    matching_docs = [doc for doc in processed_docs if doc["filename"] == filename]
-    if not matching_docs:
+    doc = processed_docs.get(filename)
+    if doc is None:
         raise HTTPException(status_code=404, detail=f"Document '{filename}' non trouvé")
-    doc = matching_docs[0]
     result = {
         "filename": doc["filename"],
         "hash": doc["hash"],
         "total_chunks": len(doc["chunks"]),
+        "aliased_chunks": len(doc.get("aliases", [])),
+        "dedup_ratio": round(get_dedup_ratio(doc), 4),
     }
     chunks_info = []
-    for i, chunk_idx in enumerate(doc["chunks"][:5]):
-        if chunk_idx < len(chunks) and chunk_idx < len(chunk_metadata):
+    for chunk_id in doc["chunks"][:5]:
+        chunk_idx = get_chunk_position(chunk_id)
+        if chunk_idx is not None:
             chunks_info.append({
+                "id": chunk_id,
                 "index": chunk_idx,
                 "metadata": chunk_metadata[chunk_idx],
                 "text_preview": chunks[chunk_idx][:100] + "..."
             })
         else:
             chunks_info.append({
-                "index": chunk_idx,
-                "error": "Indice de chunk invalide"
+                "id": chunk_id,
+                "error": "Identifiant de chunk invalide"
             })
     result["chunks_sample"] = chunks_info
     return result
@@ -240,7 +607,7 @@ async def get_sessions():
         title = sdata.get("title", "Nouvelle conversation")
         created_at = sdata.get("created_at", datetime.now()).isoformat()
         last_activity = sdata.get("last_activity", datetime.now()).isoformat()
-        message_count = len(sdata.get("messages", []))
+        message_count = 2 * len(sdata.get("turns", []))
         sessions_list.append({
             "id": sid,
             "title": title,
@@ -255,14 +622,23 @@ async def get_sessions():
 async def get_session_details(session_id: str):
     if session_id not in session_history:
         raise HTTPException(status_code=404, detail="Session non trouvée")
-    session_history[session_id]["last_activity"] = datetime.now()
+    await run_blocking(touch_session, session_id)
     sdata = session_history[session_id]
     return {
         "id": session_id,
         "title": sdata.get("title", "Nouvelle conversation"),
         "created_at": sdata.get("created_at", datetime.now()).isoformat(),
         "last_activity": sdata["last_activity"].isoformat(),
-        "messages": sdata["messages"]
+        "summary": sdata.get("summary", ""),
+        "summarized_turns": sdata.get("summarized_turns", 0),
+        "messages": [
+            message
+            for turn in sdata["turns"]
+            for message in (
+                {"role": "user", "content": turn["question"]},
+                {"role": "assistant", "content": turn["answer"] + build_sources_html(turn["sources"])}
+            )
+        ]
     }
 
 @router.delete("/session/{session_id}")
@@ -272,20 +648,20 @@ async def delete_session(session_id: str):
     raise HTTPException(status_code=404, detail="Session non trouvée")
 
 @router.delete("/document/{filename}")
-async def delete_document(filename: str):
-    matches = [i for i, doc in enumerate(processed_docs) if doc["filename"] == filename]
-    if not matches:
+async def delete_document(filename: str, background_tasks: BackgroundTasks):
+    require_ready()
+    doc = await run_blocking(remove_document, filename)
+    if doc is None:
         raise HTTPException(status_code=404, detail="Document non trouvé")
-    doc_idx = matches[0]
-    doc = processed_docs[doc_idx]
     print(f"Suppression du doc: {filename}, {len(doc['chunks'])} chunks")
     
-    processed_docs.pop(doc_idx)
     file_path = UPLOADS_DIR / filename
     if file_path.exists():
         os.remove(file_path)
         print(f"Fichier supprimé: {file_path}")
-    save_index_and_data()
+    await run_blocking(save_index_and_data)
+    if get_dead_ratio() >= COMPACTION_THRESHOLD:
+        background_tasks.add_task(compact_index)
     return {"message": f"Document {filename} supprimé avec succès"}
 
 @router.get("/debug/document/{filename}")
@@ -295,15 +671,16 @@ async def debug_document(filename: str):
 
 @router.get("/reconstruct-index")
 async def reconstruct_index(background_tasks: BackgroundTasks):
+    require_ready()
     if processing_status["is_processing"]:
         raise HTTPException(status_code=400, detail="Un traitement est déjà en cours")
     
     async def rebuild_in_background():
         try:
             processing_status["is_processing"] = True
-            ok = process_existing_chunks()
+            ok = await process_existing_chunks()
             if ok:
-                save_index_and_data()
+                await run_blocking(save_index_and_data)
                 return {"message": "Index reconstruit avec succès"}
             else:
                 return {"message": "Échec de la reconstruction de l'index"}
@@ -313,24 +690,33 @@ async def reconstruct_index(background_tasks: BackgroundTasks):
     background_tasks.add_task(rebuild_in_background)
     return {"message": "Reconstruction lancée en arrière-plan"}
 
+@router.post("/compact-index")
+async def compact_index_now(background_tasks: BackgroundTasks):
+    require_ready()
+    if processing_status["is_processing"]:
+        raise HTTPException(status_code=400, detail="Un traitement est déjà en cours")
+    if not deleted_chunk_ids:
+        return {"message": "Aucun chunk supprimé, compactage inutile"}
+    
+    async def compact_in_background():
+        await compact_index(force=True)
+    
+    background_tasks.add_task(compact_in_background)
+    return {"message": "Compactage lancé en arrière-plan"}
+
 @router.post("/reindex-document/{filename}")
 async def reindex_document(filename: str, background_tasks: BackgroundTasks):
+    require_ready()
     file_path = UPLOADS_DIR / filename
     if not file_path.exists():
         raise HTTPException(status_code=404, detail=f"{filename} n'existe pas")
     if processing_status["is_processing"]:
         raise HTTPException(status_code=400, detail="Un traitement est déjà en cours")
     
-    existing_docs = [i for i, doc in enumerate(processed_docs) if doc["filename"] == filename]
-    if existing_docs:
-        for idx in sorted(existing_docs, reverse=True):
-            processed_docs.pop(idx)
-    
-    with open(file_path, "rb") as f:
-        content = f.read()
+    await run_blocking(remove_document, filename)
     
     async def process_single():
-        await process_files_in_background([content], [filename], [file_path])
+        await process_files_in_background([filename], [file_path])
     
     background_tasks.add_task(process_single)
     return {
@@ -344,6 +730,7 @@ async def get_raw_pdf_text(filename: str):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail=f"{filename} n'existe pas")
     try:
+        import PyPDF2
         pdf_reader = PyPDF2.PdfReader(file_path)
         pages_text = []
         for page_num, page in enumerate(pdf_reader.pages):
@@ -396,6 +783,7 @@ async def debug_files():
 
 @router.post("/index-website")
 async def index_website(base_url: str = Form(...), max_pages: int = Form(50), background_tasks: BackgroundTasks = None):
+    require_ready()
     if processing_status["is_processing"]:
         raise HTTPException(status_code=400, detail="Un traitement de documents est déjà en cours")
     
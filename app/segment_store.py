@@ -0,0 +1,416 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+import numpy as np
+
+from app.metadata_store import ChunkMetadataStore, column_rows, save_columns, load_columns
+from app.lexical_index import merge_postings
+from app.dedup import merge_lsh_keys
+from app.config import (
+    SEGMENTS_DIR, MANIFEST_FILE, REGISTRY_LOG_FILE, INDEX_SNAPSHOT_FILE,
+    SEGMENT_MERGE_THRESHOLD, SEGMENT_SMALL_ROWS
+)
+
+MANIFEST_VERSION = 1
+EXTRA_MERGERS = {
+    "lexical": merge_postings,
+    "lsh": merge_lsh_keys
+}
+
+class SegmentStore:
+    def __init__(self, segments_dir=SEGMENTS_DIR, manifest_file=MANIFEST_FILE, snapshot_file=INDEX_SNAPSHOT_FILE,
+                 log_file=REGISTRY_LOG_FILE):
+        self.segments_dir = segments_dir
+        self.manifest_file = manifest_file
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.lock = threading.RLock()
+        self.manifest = self._empty_manifest()
+        self.persisted_rows = 0
+        self.persisted_tombstones = set()
+        self.pending_vectors = []
+        self.rewrite_pending = False
+        self.load_failed = False
+        self.merge_thread = None
+
+    def _empty_manifest(self):
+        return {
+            "version": MANIFEST_VERSION,
+            "next_segment_id": 1,
+            "dimension": None,
+            "next_chunk_id": 0,
+            "segments": [],
+            "tombstones": [],
+            "index_snapshot": None,
+            "text_blob": None,
+            "processed_docs": [],
+            "registry_log_size": 0
+        }
+
+    def exists(self):
+        return self.manifest_file.exists()
+
+    def segment_path(self, name):
+        return self.segments_dir / name
+
+    def load_manifest(self):
+        with open(self.manifest_file, 'r') as f:
+            self.manifest = {**self._empty_manifest(), **json.load(f)}
+        self.persisted_rows = sum(seg["rows"] for seg in self.manifest["segments"])
+        self.pending_vectors = []
+        self.rewrite_pending = False
+        self.load_failed = False
+        return self.manifest
+
+    def reset(self, load_failed=False):
+        with self.lock:
+            self.manifest = self._empty_manifest()
+            self.persisted_rows = 0
+            self.persisted_tombstones = set()
+            self.pending_vectors = []
+            self.rewrite_pending = False
+            self.load_failed = load_failed
+
+    def _read_log(self):
+        size = self.manifest["registry_log_size"]
+        if not size or not self.log_file.exists():
+            return []
+        with open(self.log_file, 'rb') as f:
+            data = f.read(size)
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    def _folded_registry(self):
+        docs = {doc["filename"]: doc for doc in self.manifest["processed_docs"]}
+        tombstones = set(self.manifest["tombstones"])
+        for delta in self._read_log():
+            for filename, doc in delta["docs"].items():
+                if doc is None:
+                    docs.pop(filename, None)
+                else:
+                    docs[filename] = doc
+            tombstones.update(delta["tombstones"])
+        return list(docs.values()), sorted(tombstones)
+
+    def load_registry(self):
+        docs, tombstones = self._folded_registry()
+        self.persisted_tombstones = set(tombstones)
+        return docs, tombstones
+
+    def _fold_registry(self):
+        if self.manifest["registry_log_size"]:
+            self.manifest["processed_docs"], self.manifest["tombstones"] = self._folded_registry()
+            self.manifest["registry_log_size"] = 0
+
+    def _append_log(self, delta):
+        size = self.manifest["registry_log_size"]
+        line = (json.dumps(delta) + "\n").encode('utf-8')
+        with open(self.log_file, 'r+b' if self.log_file.exists() else 'wb') as f:
+            f.truncate(size)
+            f.seek(size)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.manifest["registry_log_size"] = size + len(line)
+
+    def _truncate_log(self):
+        if self.log_file.exists():
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(self.manifest["registry_log_size"])
+
+    def read_segment(self, name, mmap_vectors=True, first_row=0):
+        path = self.segment_path(name)
+        vectors = np.load(path / "vectors.npy", mmap_mode='r' if mmap_vectors else None)
+        if (path / "offsets.npy").exists():
+            seg_chunks = (np.load(path / "offsets.npy"), np.load(path / "lengths.npy"))
+        else:
+            with open(path / "chunks.pkl", 'rb') as f:
+                seg_chunks = pickle.load(f)
+        if (path / "metadata.npz").exists():
+            seg_meta = load_columns(path / "metadata.npz")
+        else:
+            with open(path / "metadata.pkl", 'rb') as f:
+                seg_meta = pickle.load(f)
+        if (path / "ids.npy").exists():
+            seg_ids = np.load(path / "ids.npy")
+        else:
+            seg_ids = np.arange(first_row, first_row + column_rows(seg_meta), dtype=np.int64)
+        return vectors, seg_chunks, seg_meta, seg_ids
+
+    def read_extra(self, name, extra):
+        path = self.segment_path(name) / f"{extra}.npz"
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+    def read_extras(self, extra):
+        parts = []
+        for seg in list(self.manifest["segments"]):
+            part = self.read_extra(seg["name"], extra)
+            if part is None:
+                return None
+            parts.append(part)
+        return parts
+
+    def iter_segments(self):
+        first_row = 0
+        for seg in list(self.manifest["segments"]):
+            yield self.read_segment(seg["name"], first_row=first_row)
+            first_row += seg["rows"]
+
+    def total_rows(self):
+        return sum(seg["rows"] for seg in self.manifest["segments"])
+
+    def sample_vectors(self, max_rows, seed=0):
+        total = self.total_rows()
+        if total == 0:
+            return None
+        rng = np.random.default_rng(seed)
+        wanted = np.sort(rng.choice(total, size=min(max_rows, total), replace=False))
+        parts = []
+        first_row = 0
+        for seg in self.manifest["segments"]:
+            end_row = first_row + seg["rows"]
+            local = wanted[(wanted >= first_row) & (wanted < end_row)] - first_row
+            if len(local):
+                vectors = np.load(self.segment_path(seg["name"]) / "vectors.npy", mmap_mode='r')
+                parts.append(np.asarray(vectors[local], dtype=np.float32))
+            first_row = end_row
+        return np.concatenate(parts, axis=0)
+
+    def read_index_snapshot(self):
+        import faiss
+        snapshot = self.manifest.get("index_snapshot")
+        if not snapshot or not self.snapshot_file.exists():
+            return None
+        if snapshot["rows"] > self.total_rows():
+            return None
+        return faiss.read_index(str(self.snapshot_file)), snapshot
+
+    def snapshot_is_stale(self, refresh_ratio):
+        snapshot = self.manifest.get("index_snapshot")
+        if not snapshot:
+            return True
+        uncovered = self.total_rows() - snapshot["rows"]
+        return uncovered > snapshot["rows"] * refresh_ratio
+
+    def write_index_snapshot(self, index, index_type):
+        import faiss
+        with self.lock:
+            rows = self.persisted_rows
+            if index.ntotal != rows:
+                return False
+            tmp_file = self.snapshot_file.with_name(self.snapshot_file.name + ".tmp")
+            faiss.write_index(index, str(tmp_file))
+            os.replace(tmp_file, self.snapshot_file)
+            self.manifest["index_snapshot"] = {"rows": rows, "type": index_type}
+            self._write_manifest()
+        print(f"Instantané de l'index {index_type} écrit ({rows} vecteurs)")
+        return True
+
+    def stage_vectors(self, vectors):
+        with self.lock:
+            self.pending_vectors.append(np.asarray(vectors, dtype=np.float32))
+
+    def mark_rewrite(self, vectors):
+        with self.lock:
+            self.pending_vectors = [np.asarray(vectors, dtype=np.float32)]
+            self.persisted_rows = 0
+            self.rewrite_pending = True
+            self.manifest["index_snapshot"] = None
+
+    def _new_segment_name(self):
+        name = f"seg_{self.manifest['next_segment_id']:06d}"
+        self.manifest["next_segment_id"] += 1
+        return name
+
+    def _write_segment(self, name, vectors, seg_spans, seg_meta, seg_ids, extras=None):
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        final_path = self.segment_path(name)
+        tmp_path = self.segments_dir / (name + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir()
+        np.save(tmp_path / "vectors.npy", np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(tmp_path / "ids.npy", np.asarray(seg_ids, dtype=np.int64))
+        np.save(tmp_path / "offsets.npy", np.asarray(seg_spans[0], dtype=np.int64))
+        np.save(tmp_path / "lengths.npy", np.asarray(seg_spans[1], dtype=np.int32))
+        save_columns(tmp_path / "metadata.npz", seg_meta)
+        for extra, arrays in (extras or {}).items():
+            np.savez(tmp_path / f"{extra}.npz", **arrays)
+        os.replace(tmp_path, final_path)
+        return {"name": name, "rows": column_rows(seg_meta)}
+
+    def _write_manifest(self):
+        tmp_file = self.manifest_file.with_name(self.manifest_file.name + ".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def _remove_segments(self, names):
+        for name in names:
+            shutil.rmtree(self.segment_path(name), ignore_errors=True)
+
+    def _pending_matrix(self, new_ids, index):
+        if self.pending_vectors:
+            vectors = np.concatenate(self.pending_vectors, axis=0)
+            if len(vectors) == len(new_ids):
+                return vectors
+            print(f"ATTENTION: {len(vectors)} vecteurs en attente pour {len(new_ids)} nouveaux chunks")
+        if index is not None:
+            return index.reconstruct_batch(np.asarray(new_ids, dtype=np.int64))
+        raise ValueError("Vecteurs introuvables pour les nouveaux chunks")
+
+    def check_writable(self, rows):
+        if self.load_failed:
+            raise RuntimeError("Le manifeste n'a pas pu être chargé, sauvegarde refusée pour ne pas écraser les segments existants")
+        if rows < self.persisted_rows:
+            raise ValueError(f"{rows} chunks en mémoire pour {self.persisted_rows} déjà persistés, sauvegarde annulée")
+
+    def save(self, chunks, chunk_metadata, chunk_ids, processed_docs, tombstones, next_chunk_id, index=None, extras=None):
+        with self.lock:
+            self.check_writable(len(chunks))
+            full_registry = self.rewrite_pending or not self.exists()
+            new_rows = len(chunks) - self.persisted_rows
+            obsolete = []
+            if new_rows > 0:
+                new_ids = chunk_ids[self.persisted_rows:]
+                vectors = self._pending_matrix(new_ids, index)
+                self.manifest["dimension"] = int(vectors.shape[1])
+                entry = self._write_segment(
+                    self._new_segment_name(),
+                    vectors,
+                    chunks.spans_from(self.persisted_rows),
+                    chunk_metadata.columns(self.persisted_rows),
+                    new_ids,
+                    extras
+                )
+                if self.rewrite_pending:
+                    obsolete = [seg["name"] for seg in self.manifest["segments"]]
+                    self.manifest["segments"] = []
+                self.manifest["segments"].append(entry)
+                print(f"Segment {entry['name']} écrit ({entry['rows']} chunks)")
+            chunks.flush()
+            previous_blob = self.manifest.get("text_blob")
+            self.manifest["text_blob"] = {"name": chunks.blob_name, "size": chunks.size}
+            if previous_blob and previous_blob["name"] != chunks.blob_name:
+                obsolete_blob = chunks.store_dir / previous_blob["name"]
+            else:
+                obsolete_blob = None
+            self.manifest["next_chunk_id"] = int(next_chunk_id)
+            doc_changes = processed_docs.changes()
+            tombstones = set(tombstones)
+            if full_registry:
+                self.manifest["tombstones"] = sorted(int(cid) for cid in tombstones)
+                self.manifest["processed_docs"] = processed_docs.to_list()
+                self.manifest["registry_log_size"] = 0
+            else:
+                new_tombstones = sorted(int(cid) for cid in tombstones - self.persisted_tombstones)
+                if doc_changes or new_tombstones:
+                    self._append_log({"docs": doc_changes, "tombstones": new_tombstones})
+            self._write_manifest()
+            if full_registry:
+                self._truncate_log()
+            processed_docs.mark_clean(doc_changes)
+            self.persisted_tombstones = tombstones
+            self._remove_segments(obsolete)
+            if obsolete_blob is not None:
+                obsolete_blob.unlink(missing_ok=True)
+            self.persisted_rows = len(chunks)
+            self.pending_vectors = []
+            self.rewrite_pending = False
+        if new_rows > 0:
+            self.maybe_merge()
+        return True
+
+    def _small_runs(self):
+        runs = []
+        current = []
+        for seg in self.manifest["segments"]:
+            if seg["rows"] < SEGMENT_SMALL_ROWS:
+                current.append(seg["name"])
+            else:
+                if len(current) > 1:
+                    runs.append(current)
+                current = []
+        if len(current) > 1:
+            runs.append(current)
+        return runs
+
+    def maybe_merge(self):
+        with self.lock:
+            small_count = sum(1 for seg in self.manifest["segments"] if seg["rows"] < SEGMENT_SMALL_ROWS)
+            if small_count < SEGMENT_MERGE_THRESHOLD:
+                return False
+            if self.merge_thread is not None and self.merge_thread.is_alive():
+                return False
+            runs = self._small_runs()
+            if not runs:
+                return False
+            self.merge_thread = threading.Thread(target=self._merge_runs, args=(runs,), daemon=True)
+            self.merge_thread.start()
+            return True
+
+    def _merge_runs(self, runs):
+        for names in runs:
+            try:
+                self._merge(names)
+            except Exception as e:
+                print(f"Erreur lors de la fusion des segments: {str(e)}")
+
+    def _merge(self, names):
+        with self.lock:
+            first_rows = {}
+            row = 0
+            for seg in self.manifest["segments"]:
+                first_rows[seg["name"]] = row
+                row += seg["rows"]
+        parts = [
+            self.read_segment(name, mmap_vectors=False, first_row=first_rows.get(name, 0))
+            for name in names
+        ]
+        if any(isinstance(p[1], list) for p in parts):
+            return False
+        vectors = np.concatenate([p[0] for p in parts], axis=0)
+        merged_spans = (
+            np.concatenate([p[1][0] for p in parts]),
+            np.concatenate([p[1][1] for p in parts])
+        )
+        merged_meta = ChunkMetadataStore()
+        for p in parts:
+            if isinstance(p[2], dict):
+                merged_meta.extend_columns(p[2])
+            else:
+                merged_meta.extend(p[2])
+        merged_ids = np.concatenate([p[3] for p in parts])
+        merged_extras = {}
+        for extra, merge in EXTRA_MERGERS.items():
+            extra_parts = [self.read_extra(name, extra) for name in names]
+            if all(part is not None for part in extra_parts):
+                merged_extras[extra] = merge(extra_parts)
+
+        with self.lock:
+            merged_name = self._new_segment_name()
+        entry = self._write_segment(merged_name, vectors, merged_spans, merged_meta.columns(), merged_ids, merged_extras)
+
+        with self.lock:
+            current = [seg["name"] for seg in self.manifest["segments"]]
+            try:
+                start = current.index(names[0])
+            except ValueError:
+                start = -1
+            if start < 0 or current[start:start + len(names)] != names:
+                self._remove_segments([merged_name])
+                return False
+            segments = self.manifest["segments"]
+            self.manifest["segments"] = segments[:start] + [entry] + segments[start + len(names):]
+            self._fold_registry()
+            self._write_manifest()
+            self._truncate_log()
+            self._remove_segments(names)
+        print(f"{len(names)} segments fusionnés dans {merged_name} ({entry['rows']} chunks)")
+        return True
+
+segment_store = SegmentStore()
@@ -1,49 +1,92 @@
 import json
+import re
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from mistralai.models.chat_completion import ChatMessage
 
 from app.config import (
-    session_history, SESSIONS_FILE,
-    MAX_HISTORY_MESSAGES, MAX_TOKENS_HISTORY,
+    client, session_history, SESSIONS_FILE, SESSIONS_DB_FILE,
+    HISTORY_WINDOW_TURNS, SUMMARY_BATCH_TURNS, MAX_STORED_TURNS, SUMMARY_MODEL, SUMMARY_MAX_TOKENS,
     SESSION_TIMEOUT_MINUTES, MAX_STORED_SESSIONS
 )
+from app.tokens import count_tokens
+from app.session_store import session_store
+
+session_lock = threading.RLock()
+
+SOURCES_HTML_PATTERN = re.compile(r'<div class="sources-section">[\s\S]*?</ul></div>')
+SOURCE_ITEM_PATTERN = re.compile(r'<li><span class="source-badge">[^<]*</span> (.*?)</li>')
+
+SUMMARY_PROMPT = """You maintain a running summary of a support conversation about Fortinet products.
+Merge the previous summary and the new exchanges into one concise summary (at most 150 words).
+Keep the user's goals, product names and versions, commands, settings and conclusions reached. Drop greetings and formatting."""
+
+def new_turn(question, answer, sources=None, chunk_ids=None):
+    return {
+        "question": question,
+        "answer": answer,
+        "sources": list(sources or []),
+        "chunk_ids": list(chunk_ids or []),
+        "question_tokens": count_tokens(question),
+        "answer_tokens": count_tokens(answer)
+    }
+
+def turns_from_messages(messages):
+    turns = []
+    pending_question = None
+    for message in messages:
+        if message["role"] == "user":
+            pending_question = message["content"]
+        elif pending_question is not None:
+            content = message["content"]
+            sources_html = SOURCES_HTML_PATTERN.search(content)
+            sources = SOURCE_ITEM_PATTERN.findall(sources_html.group(0)) if sources_html else []
+            answer = SOURCES_HTML_PATTERN.sub('', content).strip()
+            turns.append(new_turn(pending_question, answer, sources))
+            pending_question = None
+    return turns
 
 def save_session_history():
     try:
-        serializable_sessions = {}
-        for session_id, session_data in session_history.items():
-            session_copy = session_data.copy()
-            session_copy["last_activity"] = session_copy["last_activity"].timestamp()
-            session_copy["created_at"] = session_copy.get("created_at", datetime.now()).timestamp()
-            serializable_sessions[session_id] = session_copy
-            
-        with open(SESSIONS_FILE, 'w') as f:
-            json.dump(serializable_sessions, f, indent=2)
-        
+        session_store.checkpoint()
         print(f"Historique des sessions sauvegardé ({len(session_history)} sessions)")
         return True
     except Exception as e:
         print(f"Erreur lors de la sauvegarde des sessions: {str(e)}")
         return False
 
+def migrate_sessions_file():
+    with open(SESSIONS_FILE, 'r') as f:
+        serialized_sessions = json.load(f)
+    
+    sessions = {}
+    for sid, sdata in serialized_sessions.items():
+        if "turns" not in sdata:
+            sdata["turns"] = turns_from_messages(sdata.pop("messages", []))
+            sdata["summary"] = ""
+        sdata["last_activity"] = datetime.fromtimestamp(sdata["last_activity"])
+        sdata["created_at"] = datetime.fromtimestamp(sdata.get("created_at", sdata["last_activity"].timestamp()))
+        sessions[sid] = sdata
+    
+    session_store.save_all(sessions)
+    Path(SESSIONS_FILE).rename(f"{SESSIONS_FILE}.migrated")
+    print(f"Migration de {SESSIONS_FILE} vers {SESSIONS_DB_FILE} ({len(sessions)} sessions)")
+
 def load_session_history():
-    global session_history
     try:
-        if Path(SESSIONS_FILE).exists():
-            with open(SESSIONS_FILE, 'r') as f:
-                serialized_sessions = json.load(f)
-                
-                for sid, sdata in serialized_sessions.items():
-                    sdata["last_activity"] = datetime.fromtimestamp(sdata["last_activity"])
-                    sdata["created_at"] = datetime.fromtimestamp(sdata["created_at"])
-                    session_history[sid] = sdata
-                
-                print(f"Historique des sessions chargé ({len(session_history)} sessions)")
-                return True
+        if Path(SESSIONS_FILE).exists() and not session_store.count():
+            migrate_sessions_file()
+        
+        with session_lock:
+            session_history.clear()
+            session_history.update(session_store.load_all())
+        
+        print(f"Historique des sessions chargé ({len(session_history)} sessions)")
+        return True
     except Exception as e:
         print(f"Erreur lors du chargement des sessions: {str(e)}")
-        session_history = {}
+        session_history.clear()
     return False
 
 def generate_session_title(first_question):
@@ -53,86 +96,138 @@ def generate_session_title(first_question):
     return question
 
 def create_or_update_session(session_id, first_question=None):
-    now = datetime.now()
-    if session_id not in session_history:
-        session_history[session_id] = {
-            "title": first_question[:40] + "..." if first_question and len(first_question) > 40 else first_question or "Nouvelle conversation",
-            "messages": [],
-            "last_activity": now,
-            "created_at": now
-        }
-    else:
-        session_history[session_id]["last_activity"] = now
-
-def add_message_to_history(session_id, role, content):
-    if session_id in session_history:
-        session_history[session_id]["messages"].append({
-            "role": role,
-            "content": content
-        })
-        
-        if len(session_history[session_id]["messages"]) > MAX_HISTORY_MESSAGES:
-            session_history[session_id]["messages"] = session_history[session_id]["messages"][-MAX_HISTORY_MESSAGES:]
-        
-        session_history[session_id]["last_activity"] = datetime.now()
-        
-        if role == "user" and len(session_history[session_id]["messages"]) == 1:
-            session_history[session_id]["title"] = generate_session_title(content)
-        
-        save_session_history()
+    with session_lock:
+        now = datetime.now()
+        if session_id not in session_history:
+            session_history[session_id] = {
+                "title": first_question[:40] + "..." if first_question and len(first_question) > 40 else first_question or "Nouvelle conversation",
+                "turns": [],
+                "summary": "",
+                "summarized_turns": 0,
+                "last_activity": now,
+                "created_at": now
+            }
+            session_store.save_session(session_id, session_history[session_id])
+        else:
+            session_history[session_id]["last_activity"] = now
+            session_store.touch(session_id, now)
 
-def get_session_messages(session_id):
+def touch_session(session_id):
+    with session_lock:
+        if session_id in session_history:
+            now = datetime.now()
+            session_history[session_id]["last_activity"] = now
+            session_store.touch(session_id, now)
+
+def add_turn_to_history(session_id, question, answer, sources=None, chunk_ids=None):
+    with session_lock:
+        if session_id in session_history:
+            session = session_history[session_id]
+            turn = new_turn(question, answer, sources, chunk_ids)
+            position = session.get("summarized_turns", 0) + len(session["turns"])
+            session["turns"].append(turn)
+            
+            if len(session["turns"]) > MAX_STORED_TURNS:
+                dropped = len(session["turns"]) - MAX_STORED_TURNS
+                session["turns"] = session["turns"][dropped:]
+                session["summarized_turns"] = session.get("summarized_turns", 0) + dropped
+            
+            session["last_activity"] = datetime.now()
+            
+            if len(session["turns"]) == 1 and not session.get("summary"):
+                session["title"] = generate_session_title(question)
+            
+            session_store.append_turn(session_id, session, position, turn)
+
+def get_session_turns(session_id):
     if session_id in session_history:
-        return session_history[session_id]["messages"]
+        return session_history[session_id]["turns"]
     return []
 
-def get_chat_messages_with_history(session_id, system_prompt, current_question):
-    chat_messages = [ChatMessage(role="system", content=system_prompt)]
-    
-    history_messages = get_session_messages(session_id)
-    for msg in history_messages:
-        chat_messages.append(ChatMessage(role=msg["role"], content=msg["content"]))
-    
-    chat_messages.append(ChatMessage(role="user", content=current_question))
+def get_session_summary(session_id):
+    if session_id in session_history:
+        return session_history[session_id].get("summary", "")
+    return ""
+
+def get_session_messages(session_id):
+    messages = []
+    for turn in get_session_turns(session_id):
+        messages.append({"role": "user", "content": turn["question"], "tokens": turn["question_tokens"]})
+        messages.append({"role": "assistant", "content": turn["answer"], "tokens": turn["answer_tokens"]})
+    return messages
+
+def needs_summary(session_id):
+    return len(get_session_turns(session_id)) >= HISTORY_WINDOW_TURNS + SUMMARY_BATCH_TURNS
+
+def summarize_session(session_id):
+    with session_lock:
+        if not needs_summary(session_id):
+            return False
+        session = session_history[session_id]
+        folded = list(session["turns"][:len(session["turns"]) - HISTORY_WINDOW_TURNS])
+        previous_summary = session.get("summary", "")
     
-    estimated_tokens = sum(len(msg.content.split()) * 1.3 for msg in chat_messages)
-    if estimated_tokens > MAX_TOKENS_HISTORY:
-        system_message = chat_messages[0]
-        current_question_message = chat_messages[-1]
-        reduced_history = history_messages[-(MAX_HISTORY_MESSAGES//2):]
-        
-        chat_messages = [system_message]
-        for msg in reduced_history:
-            chat_messages.append(ChatMessage(role=msg["role"], content=msg["content"]))
-        chat_messages.append(current_question_message)
+    exchanges = "\n\n".join(f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in folded)
+    content = f"Previous summary:\n{previous_summary or '(none)'}\n\nNew exchanges:\n{exchanges}"
+    try:
+        response = client.chat(
+            model=SUMMARY_MODEL,
+            messages=[
+                ChatMessage(role="system", content=SUMMARY_PROMPT),
+                ChatMessage(role="user", content=content)
+            ],
+            temperature=0.0,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Erreur lors du résumé de la session {session_id}: {str(e)}")
+        return False
     
-    return chat_messages
+    with session_lock:
+        session = session_history.get(session_id)
+        if session is None or len(session["turns"]) < len(folded):
+            return False
+        if any(a is not b for a, b in zip(session["turns"], folded)):
+            return False
+        session["turns"] = session["turns"][len(folded):]
+        session["summary"] = summary
+        session["summary_tokens"] = count_tokens(summary)
+        session["summarized_turns"] = session.get("summarized_turns", 0) + len(folded)
+        session_store.save_session(session_id, session)
+        session_store.delete_turns_before(session_id, session["summarized_turns"])
+    print(f"Session {session_id}: {len(folded)} échanges résumés")
+    return True
 
 def clean_expired_sessions():
-    expired_time = datetime.now() - timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    expired_sessions = [
-        sid for sid, data in session_history.items()
-        if data["last_activity"] < expired_time
-    ]
-    
-    for sid in expired_sessions:
-        del session_history[sid]
-    
-    if len(session_history) > MAX_STORED_SESSIONS:
-        sessions_by_age = sorted(
-            session_history.items(),
-            key=lambda x: x[1]["last_activity"]
-        )
-        to_remove = sessions_by_age[:len(sessions_by_age) - MAX_STORED_SESSIONS]
-        for sid, _ in to_remove:
+    with session_lock:
+        expired_time = datetime.now() - timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+        expired_sessions = [
+            sid for sid, data in session_history.items()
+            if data["last_activity"] < expired_time
+        ]
+        
+        for sid in expired_sessions:
             del session_history[sid]
-    
-    if expired_sessions or len(session_history) > MAX_STORED_SESSIONS:
-        save_session_history()
+        
+        evicted = []
+        if len(session_history) > MAX_STORED_SESSIONS:
+            sessions_by_age = sorted(
+                session_history.items(),
+                key=lambda x: x[1]["last_activity"]
+            )
+            evicted = [sid for sid, _ in sessions_by_age[:len(sessions_by_age) - MAX_STORED_SESSIONS]]
+            for sid in evicted:
+                del session_history[sid]
+        
+        if expired_sessions:
+            session_store.delete_expired(expired_time)
+        session_store.delete_sessions(evicted)
 
 def clear_session(session_id):
-    if session_id in session_history:
-        del session_history[session_id]
-        save_session_history()
-        return True
+    with session_lock:
+        if session_id in session_history:
+            del session_history[session_id]
+            session_store.delete_sessions([session_id])
+            return True
     return False
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from app.config import DATA_DIR, SESSIONS_DB_FILE
+
+SESSION_COLUMNS = ("title", "summary", "summary_tokens", "summarized_turns", "created_at", "last_activity")
+
+class SessionStore:
+    def __init__(self, db_path=SESSIONS_DB_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, title TEXT NOT NULL, "
+                "summary TEXT NOT NULL DEFAULT '', summary_tokens INTEGER NOT NULL DEFAULT 0, "
+                "summarized_turns INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, last_activity REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT NOT NULL, position INTEGER NOT NULL, "
+                "question TEXT NOT NULL, answer TEXT NOT NULL, "
+                "sources TEXT NOT NULL, chunk_ids TEXT NOT NULL, "
+                "question_tokens INTEGER NOT NULL, answer_tokens INTEGER NOT NULL, "
+                "PRIMARY KEY (session_id, position))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _session_row(self, session_id, session):
+        return (
+            session_id,
+            session["title"],
+            session.get("summary", ""),
+            session.get("summary_tokens", 0),
+            session.get("summarized_turns", 0),
+            session["created_at"].timestamp(),
+            session["last_activity"].timestamp()
+        )
+
+    def _turn_row(self, session_id, position, turn):
+        return (
+            session_id, position, turn["question"], turn["answer"],
+            json.dumps(turn["sources"]), json.dumps(turn["chunk_ids"]),
+            turn["question_tokens"], turn["answer_tokens"]
+        )
+
+    def _upsert_session(self, conn, session_id, session):
+        conn.execute(
+            f"INSERT OR REPLACE INTO sessions (session_id, {', '.join(SESSION_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._session_row(session_id, session)
+        )
+
+    def _insert_turns(self, conn, session_id, session):
+        first = session.get("summarized_turns", 0)
+        conn.executemany(
+            "INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [self._turn_row(session_id, first + i, turn) for i, turn in enumerate(session["turns"])]
+        )
+
+    def save_session(self, session_id, session):
+        with self.lock:
+            conn = self._connect()
+            self._upsert_session(conn, session_id, session)
+            conn.commit()
+
+    def touch(self, session_id, last_activity):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE sessions SET last_activity = ? WHERE session_id = ?",
+                (last_activity.timestamp(), session_id)
+            )
+            conn.commit()
+
+    def append_turn(self, session_id, session, position, turn):
+        with self.lock:
+            conn = self._connect()
+            self._upsert_session(conn, session_id, session)
+            conn.execute("INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._turn_row(session_id, position, turn))
+            conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND position < ?",
+                (session_id, session.get("summarized_turns", 0))
+            )
+            conn.commit()
+
+    def delete_turns_before(self, session_id, position):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM turns WHERE session_id = ? AND position < ?", (session_id, position))
+            conn.commit()
+
+    def delete_expired(self, expired_time):
+        with self.lock:
+            conn = self._connect()
+            cutoff = expired_time.timestamp()
+            conn.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE last_activity < ?)",
+                (cutoff,)
+            )
+            deleted = conn.execute("DELETE FROM sessions WHERE last_activity < ?", (cutoff,)).rowcount
+            conn.commit()
+            return deleted
+
+    def delete_sessions(self, session_ids):
+        if not session_ids:
+            return
+        with self.lock:
+            conn = self._connect()
+            rows = [(sid,) for sid in session_ids]
+            conn.executemany("DELETE FROM turns WHERE session_id = ?", rows)
+            conn.executemany("DELETE FROM sessions WHERE session_id = ?", rows)
+            conn.commit()
+
+    def save_all(self, sessions):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM turns")
+            conn.execute("DELETE FROM sessions")
+            for session_id, session in sessions.items():
+                self._upsert_session(conn, session_id, session)
+                self._insert_turns(conn, session_id, session)
+            conn.commit()
+
+    def load_all(self):
+        sessions = {}
+        with self.lock:
+            conn = self._connect()
+            for row in conn.execute(f"SELECT session_id, {', '.join(SESSION_COLUMNS)} FROM sessions"):
+                session = dict(zip(SESSION_COLUMNS, row[1:]))
+                session["created_at"] = datetime.fromtimestamp(session["created_at"])
+                session["last_activity"] = datetime.fromtimestamp(session["last_activity"])
+                session["turns"] = []
+                sessions[row[0]] = session
+            for row in conn.execute(
+                "SELECT session_id, question, answer, sources, chunk_ids, question_tokens, answer_tokens "
+                "FROM turns ORDER BY session_id, position"
+            ):
+                session = sessions.get(row[0])
+                if session is None:
+                    continue
+                session["turns"].append({
+                    "question": row[1],
+                    "answer": row[2],
+                    "sources": json.loads(row[3]),
+                    "chunk_ids": json.loads(row[4]),
+                    "question_tokens": row[5],
+                    "answer_tokens": row[6]
+                })
+        return sessions
+
+    def count(self):
+        with self.lock:
+            return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def checkpoint(self):
+        with self.lock:
+            self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+session_store = SessionStore()
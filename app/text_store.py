@@ -0,0 +1,147 @@
+import mmap
+import os
+import threading
+from array import array
+
+DEFAULT_BLOB_NAME = "texts_000001.bin"
+
+def encode_text(text):
+    return text.encode('utf-8', errors='replace')
+
+class ChunkTextStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.blob_name = DEFAULT_BLOB_NAME
+        self.offsets = array('q')
+        self.lengths = array('i')
+        self.size = 0
+        self.lock = threading.RLock()
+        self._file = None
+        self._mmap = None
+        self._mapped_size = 0
+
+    @property
+    def blob_path(self):
+        return self.store_dir / self.blob_name
+
+    def open(self, blob_name=DEFAULT_BLOB_NAME, committed_size=0):
+        with self.lock:
+            self.close()
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            self.blob_name = blob_name
+            self._file = open(self.blob_path, 'a+b')
+            self._file.truncate(committed_size)
+            self.size = committed_size
+            self.offsets = array('q')
+            self.lengths = array('i')
+
+    def close(self):
+        with self.lock:
+            self._mmap = None
+            self._mapped_size = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _ensure_open(self):
+        if self._file is None:
+            self.open(self.blob_name, 0)
+
+    def _view(self, end):
+        with self.lock:
+            if self._mmap is None or end > self._mapped_size:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mapped_size = len(self._mmap)
+            return self._mmap
+
+    def append_document(self, data):
+        with self.lock:
+            self._ensure_open()
+            base = self.size
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+            self.size += len(data)
+            return base
+
+    def add_spans(self, offsets, lengths):
+        self.offsets.extend(int(o) for o in offsets)
+        self.lengths.extend(int(n) for n in lengths)
+
+    def extend_texts(self, texts):
+        for text in texts:
+            data = encode_text(text)
+            self.add_spans([self.append_document(data)], [len(data)])
+
+    def flush(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def spans_from(self, start):
+        return self.offsets[start:], self.lengths[start:]
+
+    def set_spans(self, offsets, lengths):
+        self.offsets = array('q', offsets)
+        self.lengths = array('i', lengths)
+
+    def clear(self):
+        self.offsets = array('q')
+        self.lengths = array('i')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _text_at(self, pos):
+        with self.lock:
+            start = self.offsets[pos]
+            end = start + self.lengths[pos]
+            view = self._view(end)
+        return view[start:end].decode('utf-8', errors='replace')
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._text_at(i) for i in range(*pos.indices(len(self)))]
+        if pos < 0:
+            pos += len(self)
+        if pos < 0 or pos >= len(self):
+            raise IndexError("chunk index out of range")
+        return self._text_at(pos)
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self._text_at(pos)
+
+    def build_compacted(self, keep_positions, blob_name):
+        new_path = self.store_dir / blob_name
+        new_offsets = array('q')
+        new_lengths = array('i')
+        written = 0
+        span_start = span_end = None
+        span_base = 0
+        with open(new_path, 'wb') as out:
+            for pos in keep_positions:
+                start = self.offsets[pos]
+                end = start + self.lengths[pos]
+                if span_start is None or start > span_end or start < span_start:
+                    if span_start is not None:
+                        out.write(self._view(span_end)[span_start:span_end])
+                        written += span_end - span_start
+                    span_start, span_end, span_base = start, end, written
+                else:
+                    span_end = max(span_end, end)
+                new_offsets.append(span_base + start - span_start)
+                new_lengths.append(end - start)
+            if span_start is not None:
+                out.write(self._view(span_end)[span_start:span_end])
+                written += span_end - span_start
+            out.flush()
+            os.fsync(out.fileno())
+        return new_offsets, new_lengths, written
+
+    def swap(self, blob_name, offsets, lengths, size):
+        with self.lock:
+            self.open(blob_name, size)
+            self.offsets = offsets
+            self.lengths = lengths
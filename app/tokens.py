@@ -0,0 +1,14 @@
+import re
+
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if i == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
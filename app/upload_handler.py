@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+
+from app.config import UPLOADS_DIR, UPLOAD_BLOCK_SIZE
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_supported_file(filename):
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def safe_filename(name):
+    return Path(name.replace('\\', '/')).name
+
+def member_filename(name, used):
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    filename = '_'.join(parts)
+    candidate = filename
+    counter = 2
+    while candidate in used:
+        stem, dot, ext = filename.rpartition('.')
+        candidate = f"{stem}_{counter}.{ext}" if dot else f"{filename}_{counter}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+def stream_to_file(source, dest_path, block_size=UPLOAD_BLOCK_SIZE):
+    sha256_hash = hashlib.sha256()
+    tmp_path = dest_path.with_name(dest_path.name + ".part")
+    with open(tmp_path, "wb") as f:
+        for block in iter(lambda: source.read(block_size), b""):
+            sha256_hash.update(block)
+            f.write(block)
+    os.replace(tmp_path, dest_path)
+    return sha256_hash.hexdigest()
+
+async def save_upload(upload_file, dest_dir=UPLOADS_DIR, block_size=UPLOAD_BLOCK_SIZE):
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    filename = safe_filename(upload_file.filename)
+    file_path = dest_dir / filename
+    tmp_path = file_path.with_name(filename + ".part")
+    sha256_hash = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        while True:
+            block = await upload_file.read(block_size)
+            if not block:
+                break
+            sha256_hash.update(block)
+            f.write(block)
+    os.replace(tmp_path, file_path)
+    return filename, file_path, sha256_hash.hexdigest()
+
+def _expand_zip(fileobj, dest_dir):
+    extracted = []
+    used = set()
+    with zipfile.ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not safe_filename(info.filename) or not is_supported_file(info.filename):
+                continue
+            filename = member_filename(info.filename, used)
+            file_path = dest_dir / filename
+            with zf.open(info) as member:
+                file_hash = stream_to_file(member, file_path)
+            extracted.append((filename, file_path, file_hash))
+    return extracted
+
+def _expand_tar(fileobj, dest_dir):
+    extracted = []
+    used = set()
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+        for member in tf:
+            if not member.isfile() or not safe_filename(member.name) or not is_supported_file(member.name):
+                continue
+            filename = member_filename(member.name, used)
+            file_path = dest_dir / filename
+            file_hash = stream_to_file(tf.extractfile(member), file_path)
+            extracted.append((filename, file_path, file_hash))
+    return extracted
+
+async def expand_archive_upload(upload_file, dest_dir=UPLOADS_DIR):
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    await upload_file.seek(0)
+    if upload_file.filename.lower().endswith('.zip'):
+        extracted = await asyncio.to_thread(_expand_zip, upload_file.file, dest_dir)
+    else:
+        extracted = await asyncio.to_thread(_expand_tar, upload_file.file, dest_dir)
+    print(f"Archive {upload_file.filename}: {len(extracted)} fichiers extraits")
+    return extracted
@@ -4,6 +4,7 @@ import os
 import time
 import re
 import json
+from collections import Counter
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
 from typing import List, Dict, Set
@@ -12,10 +13,18 @@ from app.config import (
     UPLOADS_DIR,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    BOILERPLATE_MIN_PAGES,
+    BOILERPLATE_MIN_PAGE_RATIO,
     processing_status
 )
 from app.utils import calculate_content_hash
 
+INLINE_TAGS = ['a', 'abbr', 'b', 'code', 'em', 'i', 'kbd', 'mark', 'small', 'span', 'strong', 'sub', 'sup', 'u', 'var']
+CODE_PLACEHOLDER = re.compile(r'\x00code(\d+)\x00')
+
+class CodeBlock(str):
+    pass
+
 class WebScraper:
     def __init__(self, base_url: str, output_dir: Path = None):
         self.base_url = base_url
@@ -49,11 +58,21 @@ class WebScraper:
             
         return True
     
-    def extract_text(self, html_content: str) -> str:
+    def extract_blocks(self, html_content: str) -> List[str]:
         soup = BeautifulSoup(html_content, 'html.parser')
         
         for element in soup.find_all(['script', 'style', 'nav', 'footer']):
             element.decompose()
+        
+        code_blocks = []
+        for i, element in enumerate(soup.find_all('pre')):
+            lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in element.get_text().split('\n')]
+            code_blocks.append(CodeBlock('\n'.join(line for line in lines if line)))
+            element.replace_with(f"\n\x00code{i}\x00\n")
+        
+        for element in soup.find_all(INLINE_TAGS):
+            element.unwrap()
+        soup.smooth()
             
         main_content = soup.find('div', class_='document')
         if main_content:
@@ -61,10 +80,50 @@ class WebScraper:
         else:
             text = soup.get_text(separator='\n')
         
-        text = re.sub(r'\n+', '\n', text)
-        text = re.sub(r'\s+', ' ', text)
+        blocks = []
+        for line in text.split('\n'):
+            placeholder = CODE_PLACEHOLDER.fullmatch(line.strip())
+            if placeholder:
+                code = code_blocks[int(placeholder.group(1))]
+                if code:
+                    blocks.append(code)
+                continue
+            line = re.sub(r'\s+', ' ', line).strip()
+            if line:
+                blocks.append(line)
+        return blocks
+    
+    def extract_text(self, html_content: str) -> str:
+        return ' '.join(self.extract_blocks(html_content))
+    
+    def remove_boilerplate(self, pages: List[Dict]) -> List[Dict]:
+        min_pages = max(BOILERPLATE_MIN_PAGES, int(len(pages) * BOILERPLATE_MIN_PAGE_RATIO))
+        if len(pages) < BOILERPLATE_MIN_PAGES:
+            return pages
+        
+        block_counts = Counter()
+        for page in pages:
+            block_counts.update({block.lower() for block in page["blocks"] if not isinstance(block, CodeBlock)})
+        boilerplate = {block for block, count in block_counts.items() if count >= min_pages}
+        if not boilerplate:
+            return pages
+        
+        cleaned_pages = []
+        removed_chars = 0
+        for page in pages:
+            kept = [
+                block for block in page["blocks"]
+                if isinstance(block, CodeBlock) or block.lower() not in boilerplate
+            ]
+            text = ' '.join(kept)
+            removed_chars += len(page["text"]) - len(text)
+            if len(text) < 100:
+                print(f"Page {page['url']} ignorée après suppression du contenu répété: {len(text)} caractères")
+                continue
+            cleaned_pages.append({**page, "blocks": kept, "text": text})
         
-        return text.strip()
+        print(f"{len(boilerplate)} blocs répétés sur au moins {min_pages} pages supprimés ({removed_chars} caractères en moins)")
+        return cleaned_pages
     
     def extract_title(self, html_content: str) -> str:
         soup = BeautifulSoup(html_content, 'html.parser')
@@ -125,7 +184,8 @@ class WebScraper:
                 processing_status["processed_files"] = page_count
                 
                 html_content = response.text
-                page_text = self.extract_text(html_content)
+                page_blocks = self.extract_blocks(html_content)
+                page_text = ' '.join(page_blocks)
                 page_title = self.extract_title(html_content)
                 
                 if len(page_text) < 100:
@@ -144,6 +204,7 @@ class WebScraper:
                     "url": url,
                     "title": page_title,
                     "text": page_text,
+                    "blocks": page_blocks,
                     "filename": filename
                 }
                 
@@ -38,6 +38,8 @@ function initFileHandlers(startConversation, addBotProcessingMessage, updateLast
     const statusMessage = document.getElementById('statusMessage');
     const messagesWrapper = document.getElementById('messagesWrapper');
     
+    const isArchive = (name) => /\.(zip|tar|tar\.gz|tgz)$/i.test(name);
+    
     addFilesBtn.addEventListener('click', () => {
         fileInput.click();
     });
@@ -45,7 +47,7 @@ function initFileHandlers(startConversation, addBotProcessingMessage, updateLast
     fileInput.addEventListener('change', (e) => {
         if (e.target.files.length > 0) {
             Array.from(e.target.files).forEach(file => {
-                if (file.type === 'application/pdf' || file.type === 'text/plain' || file.name.endsWith('.txt')) {
+                if (file.type === 'application/pdf' || file.type === 'text/plain' || file.name.endsWith('.txt') || isArchive(file.name)) {
                     if (!files.some(f => f.name === file.name)) {
                         files.push(file);
                     }
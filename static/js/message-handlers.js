@@ -99,6 +99,68 @@ function updateLastBotMessage(htmlContent) {
     }
 }
 
+/**
+ * @param {string[]} sources
+ * @returns {string}
+ */
+function buildSourcesHTML(sources) {
+    if (!sources || sources.length === 0) {
+        return '';
+    }
+    return `
+        <div class="sources-section">
+            <div class="sources-title">Sources:</div>
+            <ul class="sources-list">
+                ${sources.map(source => {
+                    let sourceType = 'TXT';
+                    if (source.toLowerCase().endsWith('.pdf') || source.toLowerCase().includes('(page')) {
+                        sourceType = 'PDF';
+                    } else if (source.toLowerCase().endsWith('.html')) {
+                        sourceType = 'HTML';
+                    }
+                    return `<li><span class="source-badge">${sourceType}</span> ${source}</li>`;
+                }).join('')}
+            </ul>
+        </div>
+    `;
+}
+
+/**
+ * @param {Response} response
+ * @param {function(string, Object): void} onEvent
+ */
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (data) {
+                onEvent(eventName, JSON.parse(data));
+            }
+            boundary = buffer.indexOf('\n\n');
+        }
+    }
+}
+
 /**
  * @param {string} questionText
  */
@@ -170,73 +232,63 @@ async function processFilesAndAsk(questionText) {
             formData.append('session_id', sessionId);
         }
         
-        const response = await fetch('/ask', {
+        const response = await fetch('/ask/stream', {
             method: 'POST',
             body: formData
         });
         
-        const result = await response.json();
+        if (!response.ok) {
+            const result = await response.json();
+            throw new Error(result.detail || 'Error processing question');
+        }
+        
+        const lastBotMessage = messagesContainer.querySelector('.bot-message:last-child .message-bubble');
+        let answerText = '';
+        let sourcesHTML = '';
+        let renderPending = false;
+        let streamFailed = false;
         
-        if (response.ok) {
-            if (result.session_id) {
-                sessionId = result.session_id;
-                window.refreshSessionsListFn && window.refreshSessionsListFn();
-                
-                if (!conversationStarted || messagesContainer.querySelectorAll('.message').length <= 2) {
-                    updateConversationTitle(question.length > 40 ? question.substring(0, 40) + '...' : question);
-                }
+        const renderAnswer = () => {
+            renderPending = false;
+            if (lastBotMessage && !streamFailed) {
+                lastBotMessage.innerHTML = formatAndHighlightCode(answerText) + sourcesHTML;
+                messagesWrapper.scrollTop = messagesWrapper.scrollHeight;
             }
-            
-            let answerText = result.answer;
-            let messageHTML = '';
-            
-            messageHTML = formatAndHighlightCode(answerText);
-            
-            let sourcesHTML = '';
-            if (result.sources && result.sources.length > 0) {
-                sourcesHTML = `
-                    <div class="sources-section">
-                        <div class="sources-title">Sources:</div>
-                        <ul class="sources-list">
-                            ${result.sources.map(source => {
-                                let sourceType = 'TXT';
-                                if (source.toLowerCase().endsWith('.pdf')) {
-                                    sourceType = 'PDF';
-                                } else if (source.toLowerCase().endsWith('.html')) {
-                                    sourceType = 'HTML';
-                                }
-                                return `<li><span class="source-badge">${sourceType}</span> ${source}</li>`;
-                            }).join('')}
-                        </ul>
-                    </div>
-                `;
-            }
-            
-            const lastBotMessage = messagesContainer.querySelector('.bot-message:last-child .message-bubble');
-            if (lastBotMessage) {
-                lastBotMessage.innerHTML = messageHTML + sourcesHTML;
-                
-                document.querySelectorAll('pre code').forEach((block) => {
-                    if (window.hljs) {
-                        hljs.highlightElement(block);
-                    }
-                });
-                
-                const fullMessage = answerText + sourcesHTML;
-                
-                if (sessionId) {
-                    const messageIndex = messagesContainer.querySelectorAll('.message').length - 1;
-                    if (messageIndex >= 0) {
-                        const messages = document.querySelectorAll('.message');
-                        const lastMessage = messages[messageIndex];
-                        if (lastMessage) {
-                            lastMessage.setAttribute('data-full-message', fullMessage);
-                        }
+        };
+        
+        await readEventStream(response, (eventName, data) => {
+            if (eventName === 'sources') {
+                sourcesHTML = buildSourcesHTML(data.sources);
+                if (data.session_id) {
+                    sessionId = data.session_id;
+                    
+                    if (!conversationStarted || messagesContainer.querySelectorAll('.message').length <= 2) {
+                        updateConversationTitle(question.length > 40 ? question.substring(0, 40) + '...' : question);
                     }
                 }
+            } else if (eventName === 'token') {
+                answerText += data.content;
+                if (!renderPending) {
+                    renderPending = true;
+                    requestAnimationFrame(renderAnswer);
+                }
+            } else if (eventName === 'done') {
+                window.refreshSessionsListFn && window.refreshSessionsListFn();
+            } else if (eventName === 'error') {
+                streamFailed = true;
+                throw new Error(data.detail || 'Error processing question');
+            }
+        });
+        
+        renderAnswer();
+        
+        if (lastBotMessage && sessionId) {
+            const fullMessage = answerText + sourcesHTML;
+            const messages = document.querySelectorAll('.message');
+            const lastMessage = messages[messages.length - 1];
+            if (lastMessage) {
+                lastMessage.setAttribute('data-full-message', fullMessage);
             }
-        } else {
-            throw new Error(result.detail || 'Error processing question');
         }
     } catch (error) {
         updateLastBotMessage(`